@@ -1,18 +1,116 @@
 import logging
+import os
 import numpy as np
 import cv2
-from typing import Optional, Tuple, List
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, Optional, Tuple
 
 from capture.screen_capturer import ScreenCapturer
 from utils.debug_tools import DebugTools
 from utils.config_loader import ConfigLoader
 
 
+def cell_bbox_mask(bboxes: np.ndarray, min_ar: float, max_ar: float, min_w: float, max_w: float,
+                   min_h: float, max_h: float) -> np.ndarray:
+    """
+    Отбирает прямоугольники, похожие на ячейки холста по размеру и пропорциям.
+
+    Args:
+        bboxes: Прямоугольники (K, 4) в формате (x, y, w, h).
+        min_ar, max_ar: Допустимый диапазон соотношения сторон (строгие границы).
+        min_w, max_w: Допустимый диапазон ширины (строгие границы).
+        min_h, max_h: Допустимый диапазон высоты (строгие границы).
+
+    Returns:
+        np.ndarray: Булева маска (K,).
+    """
+    widths, heights = bboxes[:, 2], bboxes[:, 3]
+    # min_ar < w / h < max_ar без деления (h > 0 для компонент)
+    return ((min_ar * heights < widths) & (widths < max_ar * heights) &
+            (min_w < widths) & (widths < max_w) &
+            (min_h < heights) & (heights < max_h))
+
+
+def component_bboxes(binary: np.ndarray) -> np.ndarray:
+    """
+    Прямоугольники 8-связных компонент бинарного изображения.
+
+    Перед разметкой изображение обрезается до габарита ненулевых пикселей,
+    а пустое изображение отсекается сразу, без вызова разметки.
+
+    Args:
+        binary: Бинарное изображение uint8 (0/255).
+
+    Returns:
+        np.ndarray: Прямоугольники компонент (K, 4) в формате (x, y, w, h).
+    """
+    x, y, w, h = cv2.boundingRect(binary)
+    if w == 0 or h == 0:
+        return np.empty((0, 4), np.int32)
+    # Связные компоненты: статистика (x, y, w, h, area) одним вызовом, метка 0 - фон
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary[y:y + h, x:x + w], connectivity=8)
+    bboxes = stats[1:, :4]
+    bboxes[:, 0] += x
+    bboxes[:, 1] += y
+    return bboxes
+
+
+def compute_grid(rects: np.ndarray) -> Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int], Tuple[int, int]]:
+    """
+    Рассчитывает границы холста и сетку по найденным ячейкам.
+
+    Args:
+        rects: Ячейки (N, 4) в формате (x1, y1, x2, y2), N > 0.
+
+    Returns:
+        Tuple: Верхний левый угол, нижний правый угол, средний размер ячейки (ш, в)
+            и сетка (столбцы, строки).
+    """
+    avg_cell_width = max(1, int((rects[:, 2] - rects[:, 0]).mean()))
+    avg_cell_height = max(1, int((rects[:, 3] - rects[:, 1]).mean()))
+    top_left = (int(rects[:, 0].min()), int(rects[:, 1].min()))
+    bottom_right = (int(rects[:, 2].max()), int(rects[:, 3].max()))
+    cols = max(1, (bottom_right[0] - top_left[0]) // avg_cell_width)
+    rows = max(1, (bottom_right[1] - top_left[1]) // avg_cell_height)
+    return top_left, bottom_right, (avg_cell_width, avg_cell_height), (cols, rows)
+
+
+def mean_integral_threshold(gray: np.ndarray, block_size: int, c: int) -> np.ndarray:
+    """
+    Инвертированный адаптивный порог по среднему в окне через интегральное изображение.
+
+    Эквивалент adaptiveThreshold(ADAPTIVE_THRESH_MEAN_C, THRESH_BINARY_INV): сумма по окну
+    берется за четыре обращения к интегральному изображению, поэтому стоимость
+    не зависит от размера блока. Края дополняются повтором, как в OpenCV.
+
+    Args:
+        gray: Изображение в градациях серого (uint8).
+        block_size: Размер окна (нечетный).
+        c: Константа вычитания.
+
+    Returns:
+        np.ndarray: Бинарное изображение uint8 (255 - пиксель темнее среднего минус c).
+    """
+    r = block_size // 2
+    padded = cv2.copyMakeBorder(gray, r, r, r, r, cv2.BORDER_REPLICATE)
+    ii = cv2.integral(padded, sdepth=cv2.CV_64F)
+    sums = ii[block_size:, block_size:] - ii[:-block_size, block_size:] - ii[block_size:, :-block_size] \
+        + ii[:-block_size, :-block_size]
+    mean = np.rint(sums * (1.0 / (block_size * block_size)))
+    return np.where(gray <= mean - c, 255, 0).astype(np.uint8)
+
+
 class CanvasDetector:
     """
     Класс для автоматического обнаружения холста и расчета его сетки.
     """
 
+    CUDA_MIN_PIXELS = 2_000_000  # На меньших кадрах накладные расходы GPU выше выигрыша
+    STRIP_MIN_ROWS = 128  # Минимальная высота полосы при параллельной обработке
+    TEMPLATE_SIZE = 32  # Сторона шаблона угла холста (в масштабе уменьшенного изображения)
+    TEMPLATE_MIN_SCORE = 0.6  # Ниже этой оценки совпадения выполняется полный поиск
+
     def __init__(self, capturer: ScreenCapturer, debug: bool = False, config_loader: Optional[ConfigLoader] = None):
         """
         Инициализация детектора холста.
@@ -30,8 +128,362 @@ class CanvasDetector:
         self.canvas_bottom_right: Optional[Tuple[int, int]] = None
         self.cell_cols: int = 0
         self.cell_rows: int = 0
+        self._cache: Dict[str, Any] = {}  # Последний результат порог -> контуры и отпечаток кадра
+        self._gray_buf: Optional[np.ndarray] = None
+        self._thresh_buf: Optional[np.ndarray] = None
+        self._frame_buf: Optional[np.ndarray] = None  # Кадр экрана, переиспользуемый между вызовами
+        self._corner_tpl: Optional[np.ndarray] = None  # Шаблон угла последнего найденного холста
+        self._corner_size: Tuple[int, int] = (0, 0)  # Размер того холста (ш, в) в уменьшенном масштабе
+        self._cfg = self._load_settings()
+        self._cuda_available = self._detect_cuda()
+        self._opencl_available = self._detect_opencl()
         self.logger.debug("CanvasDetector инициализирован.")
 
+    def _load_settings(self) -> SimpleNamespace:
+        """
+        Считывает параметры canvas_detection один раз и готовит ядро морфологии.
+
+        Блок canvas_detection берется из конфигурации одним обращением, далее - обычный dict.get.
+
+        Returns:
+            SimpleNamespace: Параметры детекции.
+        """
+        section = self.config_loader.get("canvas_detection", {}) if self.config_loader else {}
+        get = section.get
+
+        kernel_size = get("morph_kernel_size", 3)
+        return SimpleNamespace(
+            search_offset_y_ratio=get("search_offset_y_ratio", 0.3),
+            downscale_factor=get("downscale_factor", 0.5),
+            block_size=get("adaptive_thresh_block_size", 11),
+            c=get("adaptive_thresh_c", 2),
+            kernel_size=kernel_size,
+            morph_kernel=cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size)),
+            iterations=get("morph_iterations", 1),
+            min_aspect_ratio=get("cell_min_aspect_ratio", 0.8),
+            max_aspect_ratio=get("cell_max_aspect_ratio", 1.2),
+            min_width=get("cell_min_width", 5),
+            max_width=get("cell_max_width", 100),
+            min_height=get("cell_min_height", 5),
+            max_height=get("cell_max_height", 100),
+            assume_portrait=get("assume_portrait", True),
+            fallback_cell_size=get("fallback_cell_size", 20),
+            fast_gray=get("fast_gray", False),
+            threshold_mode=get("threshold_mode", "gaussian"),
+            template_roi=get("template_roi", False),
+            use_opencl=get("use_opencl", False),
+        )
+
+    def reload_settings(self) -> None:
+        """
+        Перечитывает настройки canvas_detection (после изменения конфигурации) и сбрасывает кэш детекции.
+        """
+        self._cfg = self._load_settings()
+        self._opencl_available = self._detect_opencl()
+        self._cache = {}
+        self.logger.debug("Настройки детекции холста перечитаны.")
+
+    def _to_gray(self, img: np.ndarray, use_buffer: bool = True) -> np.ndarray:
+        """
+        Переводит RGB в градации серого, по возможности в переиспользуемый буфер.
+
+        При canvas_detection.fast_gray берется зеленый канал (основной вес яркости, ~0.587)
+        вместо взвешенной суммы cvtColor: для поиска границ ячеек этого достаточно.
+
+        Args:
+            img: Изображение в RGB.
+            use_buffer: Писать в буфер детектора (нельзя при параллельном вызове).
+
+        Returns:
+            np.ndarray: Изображение в градациях серого.
+        """
+        fast_gray = self._cfg.fast_gray
+        if not use_buffer:
+            return np.ascontiguousarray(img[:, :, 1]) if fast_gray else cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+
+        if self._gray_buf is None or self._gray_buf.shape != img.shape[:2]:
+            self._gray_buf = np.empty(img.shape[:2], np.uint8)
+        if fast_gray:
+            np.copyto(self._gray_buf, img[:, :, 1])
+            return self._gray_buf
+        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY, dst=self._gray_buf)
+
+    def _adaptive_threshold(self, gray: np.ndarray, block_size: int, c: int, use_buffer: bool = True) -> np.ndarray:
+        """
+        Адаптивная пороговая обработка (инвертированная), по возможности в переиспользуемый буфер.
+
+        Режим задается canvas_detection.threshold_mode: "gaussian" (cv2.adaptiveThreshold)
+        или "mean_integral" (среднее по окну через интегральное изображение).
+
+        Args:
+            gray: Изображение в градациях серого.
+            block_size: Размер окна (нечетный).
+            c: Константа вычитания.
+            use_buffer: Писать в буфер детектора (нельзя при параллельном вызове).
+
+        Returns:
+            np.ndarray: Бинарное изображение.
+        """
+        if self._cfg.threshold_mode == "mean_integral":
+            return mean_integral_threshold(gray, block_size, c)
+        if not use_buffer:
+            return cv2.adaptiveThreshold(
+                gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, c
+            )
+        if self._thresh_buf is None or self._thresh_buf.shape != gray.shape:
+            self._thresh_buf = np.empty(gray.shape, np.uint8)
+        return cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, c,
+            dst=self._thresh_buf
+        )
+
+    def _detect_cuda(self) -> bool:
+        """
+        Проверяет, собран ли OpenCV с CUDA и есть ли доступное устройство.
+
+        Returns:
+            bool: True, если можно использовать cv2.cuda.
+        """
+        try:
+            available = cv2.cuda.getCudaEnabledDeviceCount() > 0
+        except (AttributeError, cv2.error):
+            available = False
+        self.logger.debug(f"CUDA для детекции холста: {'доступна' if available else 'недоступна'}")
+        return available
+
+    def _threshold_cuda(self, region: np.ndarray, block_size: int, c: int) -> Optional[np.ndarray]:
+        """
+        Аналог adaptiveThreshold(GAUSSIAN_C, THRESH_BINARY_INV) на GPU.
+
+        В cv2.cuda нет adaptiveThreshold, поэтому порог строится как
+        (gaussian_mean - gray) >= c через GaussianFilter, subtract и threshold.
+
+        Args:
+            region: Изображение в RGB (при fast_gray используется зеленый канал).
+            block_size: Размер окна (нечетный).
+            c: Константа вычитания (> 0).
+
+        Returns:
+            Optional[np.ndarray]: Бинарное изображение uint8 или None, если GPU-путь не сработал.
+        """
+        try:
+            if self._cfg.fast_gray:
+                # Зеленый канал, как в _to_gray: на GPU передается только один канал
+                gpu_gray = cv2.cuda_GpuMat()
+                gpu_gray.upload(np.ascontiguousarray(region[:, :, 1]))
+            else:
+                gpu_img = cv2.cuda_GpuMat()
+                gpu_img.upload(region)
+                gpu_gray = cv2.cuda.cvtColor(gpu_img, cv2.COLOR_RGB2GRAY)
+            gauss = cv2.cuda.createGaussianFilter(cv2.CV_8UC1, cv2.CV_8UC1, (block_size, block_size), 0)
+            gpu_mean = gauss.apply(gpu_gray)
+            gpu_diff = cv2.cuda.subtract(gpu_mean, gpu_gray)
+            _, gpu_thresh = cv2.cuda.threshold(gpu_diff, c - 1, 255, cv2.THRESH_BINARY)
+            return gpu_thresh.download()
+        except cv2.error as e:
+            self.logger.warning(f"Ошибка CUDA-порога, используется CPU: {e}")
+            return None
+
+    def _detect_opencl(self) -> bool:
+        """
+        Включает OpenCL (T-API) для детекции, если это разрешено настройкой use_opencl.
+
+        Returns:
+            bool: True, если порог и морфологию можно выполнять через cv2.UMat.
+        """
+        if not self._cfg.use_opencl:
+            return False
+        try:
+            available = cv2.ocl.haveOpenCL()
+            if available:
+                cv2.ocl.setUseOpenCL(True)
+                available = cv2.ocl.useOpenCL()
+        except (AttributeError, cv2.error):
+            available = False
+        self.logger.debug(f"OpenCL для детекции холста: {'доступен' if available else 'недоступен'}")
+        return available
+
+    def _open_opencl(self, region: np.ndarray, block_size: int, c: int) -> Optional[np.ndarray]:
+        """
+        Порог и морфологическое открытие через cv2.UMat (OpenCL T-API).
+
+        Разметка компонент в OpenCL не поддерживается, поэтому результат скачивается в память.
+
+        Args:
+            region: Изображение в RGB.
+            block_size: Размер окна (нечетный).
+            c: Константа вычитания.
+
+        Returns:
+            Optional[np.ndarray]: Бинарное изображение uint8 или None, если OpenCL-путь не сработал.
+        """
+        cfg = self._cfg
+        try:
+            umat = cv2.UMat(region)
+            gray = cv2.extractChannel(umat, 1) if cfg.fast_gray else cv2.cvtColor(umat, cv2.COLOR_RGB2GRAY)
+            thresh = cv2.adaptiveThreshold(
+                gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, c
+            )
+            thresh = cv2.erode(thresh, cfg.morph_kernel, iterations=cfg.iterations)
+            thresh = cv2.dilate(thresh, cfg.morph_kernel, iterations=cfg.iterations)
+            return thresh.get()
+        except cv2.error as e:
+            self.logger.warning(f"Ошибка OpenCL-порога, используется CPU: {e}")
+            return None
+
+    def _segment(self, region: np.ndarray, block_size: int, use_cuda: bool = False,
+                 use_buffers: bool = True, use_opencl: bool = False) -> np.ndarray:
+        """
+        Порог, морфологическое открытие и поиск связных компонент на одном изображении.
+
+        Args:
+            region: Изображение в RGB.
+            block_size: Размер окна адаптивного порога (нечетный).
+            use_cuda: Пробовать выполнить порог на GPU.
+            use_buffers: Писать в буферы детектора (нельзя при параллельном вызове).
+            use_opencl: Пробовать выполнить порог и морфологию через OpenCL.
+
+        Returns:
+            np.ndarray: Прямоугольники компонент (K, 4) в формате (x, y, w, h).
+        """
+        cfg = self._cfg
+        thresh = self._open_opencl(region, block_size, cfg.c) if use_opencl else None
+        if thresh is None:
+            thresh = self._threshold_cuda(region, block_size, cfg.c) if use_cuda else None
+            if thresh is None:
+                gray = self._to_gray(region, use_buffer=use_buffers)
+                thresh = self._adaptive_threshold(gray, block_size, cfg.c, use_buffer=use_buffers)
+            # Открытие = эрозия + дилатация прямоугольным (сепарабельным) ядром
+            thresh = cv2.erode(thresh, cfg.morph_kernel, iterations=cfg.iterations)
+            thresh = cv2.dilate(thresh, cfg.morph_kernel, iterations=cfg.iterations)
+        if self.debug_tools.enabled:
+            self.debug_tools.show_image("Canvas Detect - Threshold", thresh)
+        return component_bboxes(thresh)
+
+    def _segment_strips(self, region: np.ndarray, block_size: int, max_cell_height: float) -> np.ndarray:
+        """
+        То же, что _segment, но параллельно по горизонтальным полосам.
+
+        Каждая полоса расширена полями: сверху - на радиус зависимостей порога и морфологии,
+        снизу - еще и на максимальную высоту ячейки. Компонента принадлежит той полосе,
+        в чьей основной части лежит ее верхний край, и учитывается, только если целиком
+        попала в точно рассчитанную часть полосы. Так дубликаты в перекрытиях не возникают.
+
+        Args:
+            region: Изображение в RGB.
+            block_size: Размер окна адаптивного порога (нечетный).
+            max_cell_height: Максимальная высота ячейки в масштабе region.
+
+        Returns:
+            np.ndarray: Прямоугольники компонент (K, 4) в формате (x, y, w, h).
+        """
+        cfg = self._cfg
+        height = region.shape[0]
+        num_strips = min(os.cpu_count() or 4, height // self.STRIP_MIN_ROWS)
+        if num_strips < 2:
+            return self._segment(region, block_size)
+
+        pad = block_size // 2 + 2 * cfg.iterations * (cfg.kernel_size // 2) + 1
+        overlap = int(np.ceil(max_cell_height)) + pad
+        core_bounds = np.linspace(0, height, num_strips + 1).astype(int)
+
+        def segment_strip(core_start: int, core_end: int) -> np.ndarray:
+            strip_start = max(0, core_start - pad)
+            strip_end = min(height, core_end + overlap)
+            bboxes = self._segment(region[strip_start:strip_end], block_size, use_buffers=False).copy()
+            bboxes[:, 1] += strip_start
+            exact_end = height if strip_end == height else strip_end - pad
+            keep = ((bboxes[:, 1] >= core_start) & (bboxes[:, 1] < core_end) &
+                    (bboxes[:, 1] + bboxes[:, 3] <= exact_end))
+            return bboxes[keep]
+
+        with ThreadPoolExecutor(max_workers=num_strips) as pool:
+            parts = list(pool.map(segment_strip, core_bounds[:-1], core_bounds[1:]))
+        return np.concatenate(parts)
+
+    def _match_canvas_roi(self, gray: np.ndarray, margin_x: float,
+                          margin_y: float) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Ищет угол ранее найденного холста сопоставлением с шаблоном.
+
+        Args:
+            gray: Уменьшенная область поиска в градациях серого.
+            margin_x, margin_y: Запас вокруг холста (максимальный размер ячейки).
+
+        Returns:
+            Optional[Tuple[int, int, int, int]]: Область (x0, y0, x1, y1) или None, если совпадение слабое.
+        """
+        tpl = self._corner_tpl
+        if tpl is None or gray.shape[0] < tpl.shape[0] or gray.shape[1] < tpl.shape[1]:
+            return None
+        res = cv2.matchTemplate(gray, tpl, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (mx, my) = cv2.minMaxLoc(res)
+        if score < self.TEMPLATE_MIN_SCORE:
+            self.logger.debug(f"Шаблон угла холста не найден (оценка {score:.2f}), полный поиск.")
+            return None
+
+        pad = self.TEMPLATE_SIZE // 4
+        x, y = mx + pad, my + pad
+        canvas_w, canvas_h = self._corner_size
+        mx_pad, my_pad = int(np.ceil(margin_x)), int(np.ceil(margin_y))
+        return (max(0, x - mx_pad), max(0, y - my_pad),
+                min(gray.shape[1], x + canvas_w + mx_pad), min(gray.shape[0], y + canvas_h + my_pad))
+
+    def _segment_roi(self, region: np.ndarray, roi: Tuple[int, int, int, int], block_size: int,
+                     scale_x: float, scale_y: float) -> Optional[np.ndarray]:
+        """
+        Сегментация только внутри области вокруг найденного по шаблону холста.
+
+        Результат отбрасывается, если ячейки упираются во внутреннюю границу области:
+        холст мог вырасти или сместиться, и нужен полный поиск.
+
+        Args:
+            region: Уменьшенная область поиска в RGB.
+            roi: Область (x0, y0, x1, y1).
+            block_size: Размер окна адаптивного порога (нечетный).
+            scale_x, scale_y: Коэффициенты перевода в экранный масштаб.
+
+        Returns:
+            Optional[np.ndarray]: Прямоугольники компонент в координатах region или None.
+        """
+        cfg = self._cfg
+        x0, y0, x1, y1 = roi
+        bboxes = self._segment(region[y0:y1, x0:x1], block_size)
+        cells = bboxes[cell_bbox_mask(bboxes, cfg.min_aspect_ratio, cfg.max_aspect_ratio,
+                                      cfg.min_width / scale_x, cfg.max_width / scale_x,
+                                      cfg.min_height / scale_y, cfg.max_height / scale_y)]
+        if len(cells) == 0:
+            return None
+        region_h, region_w = region.shape[:2]
+        if ((x0 > 0 and (cells[:, 0] == 0).any()) or
+                (y0 > 0 and (cells[:, 1] == 0).any()) or
+                (x1 < region_w and (cells[:, 0] + cells[:, 2] == x1 - x0).any()) or
+                (y1 < region_h and (cells[:, 1] + cells[:, 3] == y1 - y0).any())):
+            self.logger.debug("Ячейки на границе области шаблона, полный поиск.")
+            return None
+        bboxes[:, 0] += x0
+        bboxes[:, 1] += y0
+        return bboxes
+
+    def _remember_canvas_corner(self, gray: np.ndarray, x1: int, y1: int, x2: int, y2: int) -> None:
+        """
+        Сохраняет шаблон верхнего левого угла холста для следующих вызовов detect_canvas.
+
+        Args:
+            gray: Уменьшенная область поиска в градациях серого.
+            x1, y1, x2, y2: Границы холста в координатах gray.
+        """
+        size, pad = self.TEMPLATE_SIZE, self.TEMPLATE_SIZE // 4
+        px, py = x1 - pad, y1 - pad
+        self._corner_tpl = None
+        if px < 0 or py < 0 or px + size > gray.shape[1] or py + size > gray.shape[0]:
+            return
+        tpl = gray[py:py + size, px:px + size]
+        if tpl.min() == tpl.max():  # однотонный шаблон не дает оценки совпадения
+            return
+        self._corner_tpl = tpl.copy()
+        self._corner_size = (x2 - x1, y2 - y1)
+
     def detect_canvas(self) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
         """
         Автоматическое определение области холста на экране.
@@ -43,93 +495,99 @@ class CanvasDetector:
         self.logger.info("Попытка автоопределения холста...")
         try:
             # Захват полного экрана
-            full_img = self.capturer.capture_fullscreen()
+            full_img = self.capturer.capture_fullscreen(out=self._frame_buf)
             if full_img is None:
                 self.logger.error("Не удалось захватить экран для определения холста.")
                 return None, None
+            self._frame_buf = full_img
 
+            cfg = self._cfg
             h, w, _ = full_img.shape
-            search_offset_y_ratio = self.config_loader.get("canvas_detection.search_offset_y_ratio",
-                                                           0.3) if self.config_loader else 0.3
-            search_offset_y = int(h * search_offset_y_ratio)
+            search_offset_y = int(h * cfg.search_offset_y_ratio)
             canvas_region = full_img[search_offset_y:h, :]
+            downscale_factor = cfg.downscale_factor
+            block_size, c = cfg.block_size, cfg.c
+            kernel_size, iterations = cfg.kernel_size, cfg.iterations
 
-            # Преобразование в градации серого и адаптивная пороговая обработка
-            gray = cv2.cvtColor(canvas_region, cv2.COLOR_RGB2GRAY)
-            block_size = self.config_loader.get("canvas_detection.adaptive_thresh_block_size",
-                                                11) if self.config_loader else 11
-            c = self.config_loader.get("canvas_detection.adaptive_thresh_c", 2) if self.config_loader else 2
-            thresh = cv2.adaptiveThreshold(
-                gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, c
-            )
-            kernel_size = self.config_loader.get("canvas_detection.morph_kernel_size", 3) if self.config_loader else 3
-            iterations = self.config_loader.get("canvas_detection.morph_iterations", 1) if self.config_loader else 1
-            kernel = np.ones((kernel_size, kernel_size), np.uint8)
-            thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=iterations)
-            self.debug_tools.show_image("Canvas Detect - Threshold", thresh)
+            # Дешевый отпечаток кадра (разреженная выборка) и параметров конвейера
+            cache_key = (full_img.shape, full_img[::64, ::64, 0].tobytes(), search_offset_y,
+                         downscale_factor, block_size, c, kernel_size, iterations, cfg.fast_gray,
+                         cfg.threshold_mode)
+            small_gray = None
+            if self._cache.get("key") == cache_key:
+                self.logger.debug("Кадр не изменился, используются закэшированные компоненты.")
+                bboxes = self._cache["bboxes"]
+                scale_x, scale_y = self._cache["scale"]
+            else:
+                # Уменьшение области поиска: для ячеек достаточно структуры масштаба ячейки
+                if downscale_factor < 1.0:
+                    small_region = cv2.resize(canvas_region, None, fx=downscale_factor, fy=downscale_factor,
+                                              interpolation=cv2.INTER_AREA)
+                else:
+                    small_region = canvas_region
+                scale_x = canvas_region.shape[1] / small_region.shape[1]
+                scale_y = canvas_region.shape[0] / small_region.shape[0]
+
+                # Блок масштабируется вместе с изображением, но не меньше 2*kernel+1,
+                # иначе морфологическое открытие стирает тонкие контуры ячеек
+                scaled_block_size = max(2 * kernel_size + 1, int(block_size * downscale_factor) | 1)
+                # Порог размера для GPU сравнивается с фактически обрабатываемой (уменьшенной) областью
+                small_pixels = small_region.shape[0] * small_region.shape[1]
+                # GPU-пути реализуют только гауссов порог, целочисленное среднее остается на CPU
+                use_cuda = (self._cuda_available and c > 0 and small_pixels > self.CUDA_MIN_PIXELS
+                            and cfg.threshold_mode == "gaussian")
+                use_opencl = self._opencl_available and not use_cuda and cfg.threshold_mode == "gaussian"
+
+                # Сначала ищем холст рядом с углом, найденным в прошлый раз
+                bboxes = None
+                if cfg.template_roi:
+                    small_gray = self._to_gray(small_region, use_buffer=False)
+                    roi = self._match_canvas_roi(small_gray, cfg.max_width / scale_x, cfg.max_height / scale_y)
+                    if roi is not None:
+                        bboxes = self._segment_roi(small_region, roi, scaled_block_size, scale_x, scale_y)
+                if bboxes is not None:
+                    self.logger.debug("Холст найден в области шаблона угла.")
+                elif use_cuda or use_opencl or self.debug_tools.enabled:
+                    bboxes = self._segment(small_region, scaled_block_size, use_cuda=use_cuda,
+                                           use_opencl=use_opencl)
+                else:
+                    bboxes = self._segment_strips(small_region, scaled_block_size, cfg.max_height / scale_y)
+                self._cache = {"key": cache_key, "bboxes": bboxes, "scale": (scale_x, scale_y)}
+
+            # Фильтр по размеру и пропорциям для всех компонент сразу
+            # (пороги размера переводятся в масштаб уменьшенного изображения)
+            mask = cell_bbox_mask(bboxes, cfg.min_aspect_ratio, cfg.max_aspect_ratio,
+                                  cfg.min_width / scale_x, cfg.max_width / scale_x,
+                                  cfg.min_height / scale_y, cfg.max_height / scale_y)
+            cells = bboxes[mask]
+
+            # Перевод в экранные координаты (x1, y1, x2, y2)
+            rects = np.empty((len(cells), 4), dtype=np.int32)
+            rects[:, 0] = np.rint(cells[:, 0] * scale_x)
+            rects[:, 1] = np.rint(cells[:, 1] * scale_y) + search_offset_y
+            rects[:, 2] = np.rint((cells[:, 0] + cells[:, 2]) * scale_x)
+            rects[:, 3] = np.rint((cells[:, 1] + cells[:, 3]) * scale_y) + search_offset_y
 
-            # Поиск контуров
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            candidate_rects: List[Tuple[int, int, int, int]] = []
-            debug_img = canvas_region.copy()
-
-            # Параметры фильтрации контуров
-            min_aspect_ratio = self.config_loader.get("canvas_detection.cell_min_aspect_ratio",
-                                                      0.8) if self.config_loader else 0.8
-            max_aspect_ratio = self.config_loader.get("canvas_detection.cell_max_aspect_ratio",
-                                                      1.2) if self.config_loader else 1.2
-            min_width = self.config_loader.get("canvas_detection.cell_min_width", 5) if self.config_loader else 5
-            max_width = self.config_loader.get("canvas_detection.cell_max_width", 100) if self.config_loader else 100
-            min_height = self.config_loader.get("canvas_detection.cell_min_height", 5) if self.config_loader else 5
-            max_height = self.config_loader.get("canvas_detection.cell_max_height", 100) if self.config_loader else 100
-
-            for cnt in contours:
-                peri = cv2.arcLength(cnt, True)
-                approx = cv2.approxPolyDP(cnt, 0.02 * peri, True)
-                if len(approx) == 4:  # Ищем прямоугольники
-                    x, y, w_box, h_box = cv2.boundingRect(approx)
-                    aspect_ratio = w_box / h_box
-                    if (min_aspect_ratio < aspect_ratio < max_aspect_ratio and
-                            min_width < w_box < max_width and min_height < h_box < max_height):
-                        screen_x1 = x
-                        screen_x2 = x + w_box
-                        screen_y1 = y + search_offset_y
-                        screen_y2 = screen_y1 + h_box
-                        candidate_rects.append((screen_x1, screen_y1, screen_x2, screen_y2))
-                        cv2.rectangle(debug_img, (x, y), (x + w_box, y + h_box), (0, 255, 0), 2)
-
-            if not candidate_rects:
+            if self.debug_tools.enabled:
+                debug_img = canvas_region.copy()
+                for x1, y1, x2, y2 in rects.tolist():
+                    cv2.rectangle(debug_img, (x1, y1 - search_offset_y), (x2, y2 - search_offset_y), (0, 255, 0), 2)
+                self.debug_tools.show_image(
+                    "Canvas Detect - Cells" if len(rects) else "Canvas Detect - No Cells", debug_img
+                )
+
+            if len(rects) == 0:
                 self.logger.error("Не удалось обнаружить ячейки холста.")
-                self.debug_tools.show_image("Canvas Detect - No Cells", debug_img)
                 return None, None
 
-            self.debug_tools.show_image("Canvas Detect - Cells", debug_img)
-
-            # Расчет средней ячейки
-            cell_widths = [rect[2] - rect[0] for rect in candidate_rects]
-            cell_heights = [rect[3] - rect[1] for rect in candidate_rects]
-            avg_cell_width = int(np.mean(cell_widths))
-            avg_cell_height = int(np.mean(cell_heights))
+            top_left, bottom_right, (avg_cell_width, avg_cell_height), (self.cell_cols, self.cell_rows) = \
+                compute_grid(rects)
             self.logger.info(f"Средний размер ячейки: {avg_cell_width}x{avg_cell_height}")
 
-            # Определение границ холста
-            all_x = [rect[0] for rect in candidate_rects] + [rect[2] for rect in candidate_rects]
-            all_y = [rect[1] for rect in candidate_rects] + [rect[3] for rect in candidate_rects]
-            top_left = (min(all_x), min(all_y))
-            bottom_right = (max(all_x), max(all_y))
-
-            # Расчет сетки
-            canvas_width = bottom_right[0] - top_left[0]
-            canvas_height = bottom_right[1] - top_left[1]
-            self.cell_cols = max(1, canvas_width // avg_cell_width)
-            self.cell_rows = max(1, canvas_height // avg_cell_height)
-
-            # Коррекция ориентации на основе конфигурации
-            assume_portrait = self.config_loader.get("canvas_detection.assume_portrait",
-                                                     True) if self.config_loader else True
-            # Если assume_portrait=True и столбцов больше, чем строк,
+            # Коррекция ориентации на основе конфигурации:
+            # если assume_portrait=True и столбцов больше, чем строк,
             # предполагаем портретную ориентацию и меняем местами
-            if assume_portrait and self.cell_cols > self.cell_rows:
+            if cfg.assume_portrait and self.cell_cols > self.cell_rows:
                 self.cell_cols, self.cell_rows = self.cell_rows, self.cell_cols
                 self.logger.info(f"Ориентация скорректирована: {self.cell_cols}x{self.cell_rows}")
 
@@ -137,6 +595,11 @@ class CanvasDetector:
             self.logger.info(f"Автоопределенный холст: TL={top_left}, BR={bottom_right}")
             self.canvas_top_left = top_left
             self.canvas_bottom_right = bottom_right
+            self._cache["region"] = (top_left, bottom_right)
+            if small_gray is not None:
+                self._remember_canvas_corner(small_gray, *(int(v) for v in (
+                    cells[:, 0].min(), cells[:, 1].min(),
+                    (cells[:, 0] + cells[:, 2]).max(), (cells[:, 1] + cells[:, 3]).max())))
             return top_left, bottom_right
 
         except Exception as e:
@@ -151,41 +614,33 @@ class CanvasDetector:
             top_left: Координаты верхнего левого угла.
             bottom_right: Координаты нижнего правого угла.
         """
+        # Кэш детекции относится к другой области холста
+        if self._cache.get("region") != (top_left, bottom_right):
+            self._cache = {}
         self.canvas_top_left = top_left
         self.canvas_bottom_right = bottom_right
 
         # Захват области холста для расчета сетки
         canvas_img = self.capturer.capture_area(top_left, bottom_right)
         if canvas_img is not None:
+            cfg = self._cfg
             h, w, _ = canvas_img.shape
-            gray = cv2.cvtColor(canvas_img, cv2.COLOR_RGB2GRAY)
-            block_size = self.config_loader.get("canvas_detection.adaptive_thresh_block_size",
-                                                11) if self.config_loader else 11
-            c = self.config_loader.get("canvas_detection.adaptive_thresh_c", 2) if self.config_loader else 2
-            thresh = cv2.adaptiveThreshold(
-                gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, c
-            )
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            cell_sizes = []
-            min_width = self.config_loader.get("canvas_detection.cell_min_width", 5) if self.config_loader else 5
-            max_width = self.config_loader.get("canvas_detection.cell_max_width", 100) if self.config_loader else 100
-            min_height = self.config_loader.get("canvas_detection.cell_min_height", 5) if self.config_loader else 5
-            max_height = self.config_loader.get("canvas_detection.cell_max_height", 100) if self.config_loader else 100
-            for cnt in contours:
-                x, y, w_box, h_box = cv2.boundingRect(cnt)
-                if min_width < w_box < max_width and min_height < h_box < max_height:
-                    cell_sizes.append((w_box, h_box))
-
-            if cell_sizes:
-                avg_cell_width = int(np.mean([size[0] for size in cell_sizes]))
-                avg_cell_height = int(np.mean([size[1] for size in cell_sizes]))
+            gray = self._to_gray(canvas_img)
+            thresh = self._adaptive_threshold(gray, cfg.block_size, cfg.c)
+            bboxes = component_bboxes(thresh)
+            mask = cell_bbox_mask(bboxes, 0.0, float("inf"),
+                                  cfg.min_width, cfg.max_width, cfg.min_height, cfg.max_height)
+            cells = bboxes[mask]
+
+            if len(cells):
+                avg_cell_width = int(cells[:, 2].mean())
+                avg_cell_height = int(cells[:, 3].mean())
                 self.cell_cols = max(1, w // avg_cell_width)
                 self.cell_rows = max(1, h // avg_cell_height)
                 self.logger.info(f"Сетка рассчитана вручную: {self.cell_cols}x{self.cell_rows}")
             else:
                 # Используем настраиваемый размер ячейки из конфигурации
-                fallback_cell_size = self.config_loader.get("canvas_detection.fallback_cell_size",
-                                                            20) if self.config_loader else 20
+                fallback_cell_size = cfg.fallback_cell_size
                 self.cell_cols = max(1, w // fallback_cell_size)
                 self.cell_rows = max(1, h // fallback_cell_size)
                 self.logger.warning(
@@ -193,3 +648,24 @@ class CanvasDetector:
                 )
 
         self.logger.info(f"Холст установлен вручную: TL={top_left}, BR={bottom_right}")
+
+    def sample_cell_colors(self, screen_xs: np.ndarray, screen_ys: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Захватывает холст и возвращает текущий цвет в центре каждой клетки.
+
+        Args:
+            screen_xs: Экранные X-координаты центров столбцов.
+            screen_ys: Экранные Y-координаты центров строк.
+
+        Returns:
+            Optional[np.ndarray]: Цвета клеток (rows, cols, 3) RGB или None при ошибке захвата.
+        """
+        if not self.canvas_top_left or not self.canvas_bottom_right:
+            return None
+        canvas_img = self.capturer.capture_area(self.canvas_top_left, self.canvas_bottom_right)
+        if canvas_img is None:
+            self.logger.warning("Не удалось захватить холст для определения цвета клеток.")
+            return None
+        rows = np.asarray(screen_ys) - self.canvas_top_left[1]
+        cols = np.asarray(screen_xs) - self.canvas_top_left[0]
+        return canvas_img[np.ix_(rows, cols)]
@@ -1,3 +1,4 @@
+import heapq
 import logging
 import numpy as np
 import cv2
@@ -5,30 +6,193 @@ from typing import Optional, List, Tuple
 
 from capture.screen_capturer import ScreenCapturer
 from utils.debug_tools import DebugTools
+from utils.config_loader import ConfigLoader
+from utils.jit import njit, NUMBA_AVAILABLE
 from image_processing.kmeans_handler import KMeansHandler
 
 
+@njit(cache=True)
+def average_patches(img: np.ndarray, regions: np.ndarray) -> np.ndarray:
+    """
+    Средний цвет прямоугольных областей изображения (с отбрасыванием дробной части).
+
+    Args:
+        img: Изображение (H, W, 3) uint8.
+        regions: Области (N, 4) в формате (x0, y0, x1, y1), непустые и в границах изображения.
+
+    Returns:
+        np.ndarray: Средние цвета (N, 3) int64.
+    """
+    n = regions.shape[0]
+    means = np.zeros((n, 3), dtype=np.int64)
+    for k in range(n):
+        x0, y0, x1, y1 = regions[k, 0], regions[k, 1], regions[k, 2], regions[k, 3]
+        r = np.int64(0)
+        g = np.int64(0)
+        b = np.int64(0)
+        for y in range(y0, y1):
+            for x in range(x0, x1):
+                r += img[y, x, 0]
+                g += img[y, x, 1]
+                b += img[y, x, 2]
+        count = (y1 - y0) * (x1 - x0)
+        means[k, 0] = r // count
+        means[k, 1] = g // count
+        means[k, 2] = b // count
+    return means
+
+
+def ring_kernel(radius: int, size: int) -> np.ndarray:
+    """
+    Нормированное кольцо заданного радиуса (толщиной около 2 пикселей) для свертки с картой границ.
+
+    Args:
+        radius: Радиус кольца.
+        size: Размер ядра (нечетный, не меньше 2 * radius + 3).
+
+    Returns:
+        np.ndarray: Ядро (size, size) float32 с суммой 1.
+    """
+    yy, xx = np.mgrid[:size, :size] - size // 2
+    ring = (np.abs(np.hypot(yy, xx) - radius) < 1.0).astype(np.float32)
+    return ring / ring.sum()
+
+
+def detect_rings(edges: np.ndarray, kernels: List[Tuple[int, np.ndarray]], min_dist: int,
+                 min_fill: float) -> Optional[np.ndarray]:
+    """
+    Поиск окружностей фиксированных радиусов сверткой карты границ с кольцами.
+
+    Свертка линейна, поэтому кольца всех радиусов суммируются в одно ядро и карта
+    границ сворачивается один раз. Отклик в точке - средняя доля колец, лежащая на границах.
+    Берутся локальные максимумы выше min_fill с подавлением ближе min_dist, радиус
+    каждого центра уточняется по отдельным кольцам только в этой точке.
+
+    Args:
+        edges: Карта границ (Canny) uint8.
+        kernels: Пары (радиус, кольцо ring_kernel) одинакового размера.
+        min_dist: Минимальное расстояние между центрами.
+        min_fill: Минимальная доля кольца на границах (0-1).
+
+    Returns:
+        Optional[np.ndarray]: Круги в формате HoughCircles (1, N, 3) float32 или None.
+    """
+    edges_f = edges.astype(np.float32) * (1.0 / 255.0)
+    combined = sum(kernel for _, kernel in kernels) / len(kernels)
+    scores = cv2.filter2D(edges_f, cv2.CV_32F, combined, borderType=cv2.BORDER_CONSTANT)
+
+    peaks = (scores >= cv2.dilate(scores, np.ones((3, 3), np.uint8))) & (scores >= min_fill)
+    ys, xs = np.nonzero(peaks)
+    if len(ys) == 0:
+        return None
+
+    half = combined.shape[0] // 2
+    padded = cv2.copyMakeBorder(edges_f, half, half, half, half, cv2.BORDER_CONSTANT, value=0)
+    found: List[Tuple[int, int, int]] = []
+    for k in np.argsort(-scores[ys, xs], kind="stable"):
+        x, y = int(xs[k]), int(ys[k])
+        if all((x - fx) ** 2 + (y - fy) ** 2 >= min_dist * min_dist for fx, fy, _ in found):
+            window = padded[y:y + 2 * half + 1, x:x + 2 * half + 1]
+            radius = max(kernels, key=lambda item: float((window * item[1]).sum()))[0]
+            found.append((x, y, radius))
+    return np.array([found], dtype=np.float32)
+
+
+def median_cut(pixels: np.ndarray, num_colors: int) -> np.ndarray:
+    """
+    Квантование цветов методом медианного сечения (MMCQ).
+
+    Группа с наибольшим разбросом по одному из каналов делится по этому каналу, пока
+    не наберется num_colors групп или делить станет нечего. Итераций EM нет.
+    Цвета палитры образуют плотные сгустки, поэтому разрез проходит по самому широкому
+    промежутку между соседними значениями, а не строго по медиане, которая
+    разрезала бы сгусток пополам.
+
+    Args:
+        pixels: Пиксели (N, 3) uint8, N > 0.
+        num_colors: Требуемое число цветов.
+
+    Returns:
+        np.ndarray: Центры групп (M, 3) float64, M <= num_colors.
+    """
+    def entry(bucket: np.ndarray) -> Tuple[int, int, np.ndarray]:
+        spread = bucket.max(axis=0).astype(np.int32) - bucket.min(axis=0)
+        return -int(spread.max()), next(counter), bucket
+
+    counter = iter(range(2 * num_colors + 1))
+    heap = [entry(pixels)]
+    while len(heap) < num_colors and heap[0][0] < 0:
+        _, _, bucket = heapq.heappop(heap)
+        channel = int((bucket.max(axis=0).astype(np.int32) - bucket.min(axis=0)).argmax())
+        bucket = bucket[np.argsort(bucket[:, channel], kind="stable")]
+        cut = int(np.diff(bucket[:, channel].astype(np.int32)).argmax()) + 1
+        heapq.heappush(heap, entry(bucket[:cut]))
+        heapq.heappush(heap, entry(bucket[cut:]))
+    return np.array([bucket.mean(axis=0) for _, _, bucket in heap])
+
+
 class PaletteAnalyzer:
     """
     Класс для анализа палитры: определение области, извлечение цветов и позиции ластика.
     """
 
-    def __init__(self, capturer: ScreenCapturer, debug: bool = False):
+    CIRCLE_RADII = (23, 24, 25)  # Радиусы кругов палитры (пиксели)
+    CIRCLE_MIN_DIST = 30  # Минимальное расстояние между центрами кругов
+    PREDICT_STEP = 2  # Шаг сетки пикселей при поиске позиций кластеров K-Means
+    HOUGH_PARAM2 = 20  # Базовый порог накопителя HoughCircles
+    HOUGH_MAX_CANDIDATES = 20  # Больше кандидатов - порог накопителя повышается
+    PALETTE_CIRCLES = 10  # Число кругов палитры
+    MMCQ_MAX_COLORS = 16  # В режиме auto медианное сечение используется до этого числа цветов
+
+    def __init__(self, capturer: ScreenCapturer, debug: bool = False, config_loader: Optional[ConfigLoader] = None):
         """
         Инициализация анализатора палитры.
 
         Args:
             capturer: Экземпляр ScreenCapturer для захвата экрана.
             debug: Включение режима отладки с OpenCV.
+            config_loader: Экземпляр ConfigLoader для доступа к настройкам.
         """
         self.logger = logging.getLogger(__name__)
         self.capturer = capturer
+        self.config_loader = config_loader
         self.debug_tools = DebugTools(debug)
         self.kmeans_handler = KMeansHandler()
         self.palette_top_left: Optional[Tuple[int, int]] = None
         self.palette_bottom_right: Optional[Tuple[int, int]] = None
         self.circles: List[Tuple[int, int, int]] = []  # (x, y, radius)
         self.eraser_pos: Optional[Tuple[int, int]] = None
+        # Инварианты кругов, рассчитываемые в set_palette: центры относительно палитры,
+        # радиусы сэмплирования и позиции клика
+        self._centers_rel = np.empty((0, 2), np.int32)
+        self._modal_radius = 0  # Самый частый радиус кругов палитры
+        self._sample_radius = 1  # Полусторона области сэмплирования цвета
+        self._click_positions: List[Tuple[int, int]] = []
+        # Области сэмплирования (N, 4) (x0, y0, x1, y1) и их позиции клика для изображения размера _sample_shape
+        self._sample_bounds = np.empty((0, 4), np.int32)
+        self._sample_clicks: List[Tuple[int, int]] = []
+        self._sample_shape: Optional[Tuple[int, int]] = None
+        # Буферы серого и размытого изображения для detect_palette (пересоздаются при смене размера)
+        self._gray_buf: Optional[np.ndarray] = None
+        self._blur_buf: Optional[np.ndarray] = None
+        # Координаты пикселей сетки PREDICT_STEP (y, x) в порядке reshape(-1) для последнего размера палитры
+        self._pixel_coords: Optional[Tuple[Tuple[int, int], np.ndarray, np.ndarray]] = None
+        section = config_loader.get("palette_detection", {}) if config_loader else {}
+        self.circle_detector: str = section.get("circle_detector", "hough")
+        self.ring_min_fill: float = section.get("ring_min_fill", 0.3)
+        self.downscale_factor: float = section.get("downscale_factor", 0.5)
+        self.fallback_quantizer: str = section.get("fallback_quantizer", "auto")
+        self._hough_param2 = self.HOUGH_PARAM2  # Подобранный порог накопителя с прошлого вызова
+        # Радиусы и расстояние между кругами в масштабе уменьшенной области поиска
+        self._min_radius = max(1, int(np.floor(min(self.CIRCLE_RADII) * self.downscale_factor)))
+        self._max_radius = int(np.ceil(max(self.CIRCLE_RADII) * self.downscale_factor))
+        self._min_dist = max(1, int(round(self.CIRCLE_MIN_DIST * self.downscale_factor)))
+        ring_size = 2 * self._max_radius + 3
+        self._ring_kernels = [(radius, ring_kernel(radius, ring_size))
+                              for radius in range(self._min_radius, self._max_radius + 1)]
+        if NUMBA_AVAILABLE:
+            # Компиляция ядра заранее, а не при первом извлечении цветов
+            average_patches(np.zeros((1, 1, 3), np.uint8), np.array([[0, 0, 1, 1]], np.int32))
         self.logger.debug("PaletteAnalyzer инициализирован.")
 
     def detect_palette(self) -> Tuple[
@@ -50,52 +214,73 @@ class PaletteAnalyzer:
             h, w, _ = full_img.shape
             # Ограничиваем область поиска верхними 10% и левой третью экрана
             search_region = full_img[0:int(h * 0.1), 0:int(w * 0.33)]
-            self.debug_tools.show_image("Palette Detect - Search Region", search_region)
-
-            # Преобразование и размытие для поиска кругов
-            gray = cv2.cvtColor(search_region, cv2.COLOR_RGB2GRAY)
-            gray = cv2.GaussianBlur(gray, (3, 3), 0)
-            self.debug_tools.show_image("Palette Detect - Gray Blurred", gray)
+            if self.debug_tools.enabled:
+                self.debug_tools.show_image("Palette Detect - Search Region", search_region)
 
-            # Поиск кругов с помощью HoughCircles
-            circles = cv2.HoughCircles(
-                gray, cv2.HOUGH_GRADIENT, dp=1.2, minDist=30,
-                param1=50, param2=20, minRadius=23, maxRadius=25
-            )
+            # Уменьшение, преобразование и размытие для поиска кругов
+            if self.downscale_factor < 1.0:
+                small = cv2.resize(search_region, None, fx=self.downscale_factor, fy=self.downscale_factor,
+                                   interpolation=cv2.INTER_AREA)
+            else:
+                small = search_region
+            if self._gray_buf is None or self._gray_buf.shape != small.shape[:2]:
+                self._gray_buf = np.empty(small.shape[:2], np.uint8)
+                self._blur_buf = np.empty(small.shape[:2], np.uint8)
+            cv2.cvtColor(small, cv2.COLOR_RGB2GRAY, dst=self._gray_buf)
+            gray = cv2.GaussianBlur(self._gray_buf, (3, 3), 0, dst=self._blur_buf)
+            if self.debug_tools.enabled:
+                self.debug_tools.show_image("Palette Detect - Gray Blurred", gray)
+
+            circles = None
+            if self.circle_detector == "ring":
+                # Круги известного радиуса: свертка границ (пороги Canny как у param1=50) с кольцами
+                edges = cv2.Canny(gray, 25, 50)
+                circles = detect_rings(edges, self._ring_kernels, self._min_dist, self.ring_min_fill)
+                if circles is None:
+                    self.logger.debug("Кольцевой детектор не нашел кругов, используется HoughCircles.")
+            if circles is None:
+                circles = self._hough_circles(gray)
 
             if circles is None:
                 self.logger.error("Круги палитры не найдены.")
-                self.debug_tools.show_image("Palette Detect - No Circles", gray)
+                if self.debug_tools.enabled:
+                    self.debug_tools.show_image("Palette Detect - No Circles", gray)
                 return None, None, [], None
 
-            circles_uint = np.uint16(np.around(circles[0]))
+            # Центры и радиусы обратно в масштаб экрана
+            circles_uint = np.uint16(np.around(circles[0] / self.downscale_factor))
             self.logger.info(f"Найдено {len(circles_uint)} кругов до фильтрации.")
 
             # Ограничение до 10 кругов, сортировка по X
-            circles_sorted = sorted(circles_uint, key=lambda c: c[0])[:10]
+            circles_sorted = circles_uint[np.argsort(circles_uint[:, 0], kind="stable")][:10]
             self.logger.info(f"Ограничено до {len(circles_sorted)} кругов.")
 
+            # Круги палитры одинаковые: всем кругам присваивается самый частый радиус
+            modal_radius = int(np.bincount(circles_sorted[:, 2]).argmax())
+            circles_sorted[:, 2] = modal_radius
+
             # Преобразование в абсолютные координаты
-            final_circles_data: List[Tuple[int, int, int]] = []
-            circles_img = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
-            for i in circles_sorted:
-                rel_x, rel_y, radius = i[0], i[1], i[2]
-                abs_x = rel_x  # Относительно полного экрана (координаты уже в системе экрана)
-                abs_y = rel_y
-                final_circles_data.append((abs_x, abs_y, radius))
-                cv2.circle(circles_img, (rel_x, rel_y), radius, (0, 255, 0), 2)
-                cv2.circle(circles_img, (rel_x, rel_y), 1, (0, 0, 255), 3)
-
-            self.debug_tools.show_image("Palette Detect - Found Circles", circles_img)
+            # (область поиска начинается в углу экрана, координаты уже в системе экрана)
+            final_circles_data: List[Tuple[int, int, int]] = [
+                (x, y, radius) for x, y, radius in circles_sorted.tolist()
+            ]
+
+            if self.debug_tools.enabled:
+                circles_img = search_region.copy()
+                for x, y, radius in final_circles_data:
+                    cv2.circle(circles_img, (x, y), radius, (0, 255, 0), 2)
+                    cv2.circle(circles_img, (x, y), 1, (0, 0, 255), 3)
+                self.debug_tools.show_image("Palette Detect - Found Circles", circles_img)
 
             # Определение ластика (самый правый круг)
             eraser_center = (final_circles_data[-1][0], final_circles_data[-1][1]) if final_circles_data else None
 
             # Определение границ палитры
-            all_x = [c[0] - c[2] for c in final_circles_data] + [c[0] + c[2] for c in final_circles_data]
-            all_y = [c[1] - c[2] for c in final_circles_data] + [c[1] + c[2] for c in final_circles_data]
-            palette_top_left = (min(all_x), min(all_y))
-            palette_bottom_right = (max(all_x), max(all_y))
+            # (в int32: в uint16 разность x - r переполняется у края экрана)
+            arr = np.asarray(final_circles_data, dtype=np.int32)
+            xs, ys, rs = arr[:, 0], arr[:, 1], arr[:, 2]
+            palette_top_left = (int((xs - rs).min()), int((ys - rs).min()))
+            palette_bottom_right = (int((xs + rs).max()), int((ys + rs).max()))
 
             if self.debug_tools.enabled:
                 debug_final_img = full_img.copy()
@@ -117,6 +302,48 @@ class PaletteAnalyzer:
             self.logger.exception(f"Ошибка автоопределения палитры: {e}")
             return None, None, [], None
 
+    def _hough_circles(self, gray: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Поиск кругов HoughCircles с подстройкой порога накопителя.
+
+        Если кандидатов намного больше 10 кругов палитры, порог param2 повышается
+        (до 3 раз на 20%), пока их не станет не больше HOUGH_MAX_CANDIDATES или
+        кругов не начнет не хватать. Подобранный порог используется при следующем вызове;
+        если с ним найдено меньше 10 кругов, поиск повторяется с базовым HOUGH_PARAM2.
+
+        Args:
+            gray: Размытое изображение области поиска в градациях серого.
+
+        Returns:
+            Optional[np.ndarray]: Круги (1, N, 3) или None.
+        """
+        def hough(param2: int) -> Optional[np.ndarray]:
+            return cv2.HoughCircles(
+                gray, cv2.HOUGH_GRADIENT, dp=1.2, minDist=self._min_dist,
+                param1=50, param2=param2, minRadius=self._min_radius, maxRadius=self._max_radius
+            )
+
+        param2 = self._hough_param2
+        circles = hough(param2)
+        # Подобранный порог не должен терять круги: при нехватке повтор с базовым порогом
+        if param2 != self.HOUGH_PARAM2 and (circles is None or len(circles[0]) < self.PALETTE_CIRCLES):
+            param2 = self.HOUGH_PARAM2
+            circles = hough(param2)
+
+        for _ in range(3):
+            if circles is None or len(circles[0]) <= self.HOUGH_MAX_CANDIDATES:
+                break
+            stricter = max(param2 + 1, int(round(param2 * 1.2)))
+            candidate = hough(stricter)
+            if candidate is None or len(candidate[0]) < self.PALETTE_CIRCLES:
+                break
+            param2, circles = stricter, candidate
+
+        if param2 != self._hough_param2:
+            self.logger.debug(f"Порог накопителя HoughCircles: param2={param2}")
+        self._hough_param2 = param2
+        return circles
+
     def set_palette(self, top_left: Tuple[int, int], bottom_right: Tuple[int, int],
                     circles: List[Tuple[int, int, int]]) -> None:
         """
@@ -130,8 +357,34 @@ class PaletteAnalyzer:
         self.palette_top_left = top_left
         self.palette_bottom_right = bottom_right
         self.circles = circles
+        circles_np = np.asarray(circles, dtype=np.int32).reshape(-1, 3)
+        self._centers_rel = circles_np[:, :2] - np.asarray(top_left, dtype=np.int32)
+        self._modal_radius = int(np.bincount(circles_np[:, 2]).argmax()) if len(circles_np) else 0
+        self._sample_radius = max(1, self._modal_radius // 4)
+        self._click_positions = [tuple(xy) for xy in circles_np[:, :2].tolist()]
+        self._build_sample_regions((bottom_right[1] - top_left[1], bottom_right[0] - top_left[0]))
         self.logger.info(f"Палитра установлена вручную: TL={top_left}, BR={bottom_right}, Кругов: {len(circles)}")
 
+    def _build_sample_regions(self, shape: Tuple[int, int]) -> None:
+        """
+        Заранее рассчитывает области сэмплирования цвета вокруг центров кругов.
+
+        Args:
+            shape: Размер изображения палитры (высота, ширина).
+        """
+        height, width = shape
+        self._sample_shape = (height, width)
+        starts = np.maximum(0, self._centers_rel - self._sample_radius)
+        ends = np.minimum((width, height), self._centers_rel + self._sample_radius + 1)
+        bounds = np.hstack([starts, ends]).astype(np.int32)
+
+        valid = (starts < ends).all(axis=1)
+        for i in np.flatnonzero(~valid):
+            x_start, y_start, x_end, y_end = bounds[i]
+            self.logger.warning(f"Круг {i + 1} дал пустую область: ({x_start}: {x_end}, {y_start}: {y_end})")
+        self._sample_bounds = bounds[valid]
+        self._sample_clicks = [click for click, ok in zip(self._click_positions, valid) if ok]
+
     def set_eraser(self, eraser_pos: Optional[Tuple[int, int]]) -> None:
         """
         Устанавливает позицию ластика.
@@ -175,37 +428,35 @@ class PaletteAnalyzer:
 
         if self.circles:
             self.logger.info(f"Извлечение цветов на основе {len(self.circles)} кругов...")
-            palette_colors_data = []
-            debug_palette_img = palette_img.copy() if self.debug_tools.enabled else None
-
-            for i, (circle_x, circle_y, radius) in enumerate(self.circles):
-                rel_x = circle_x - self.palette_top_left[0]
-                rel_y = circle_y - self.palette_top_left[1]
-                sample_radius = max(1, radius // 4)
-                y_start = max(0, rel_y - sample_radius)
-                y_end = min(palette_img.shape[0], rel_y + sample_radius + 1)
-                x_start = max(0, rel_x - sample_radius)
-                x_end = min(palette_img.shape[1], rel_x + sample_radius + 1)
-
-                if y_start >= y_end or x_start >= x_end:
-                    self.logger.warning(f"Круг {i + 1} дал пустую область: ({x_start}: {x_end}, {y_start}: {y_end})")
-                    continue
-
-                sample_area = palette_img[y_start:y_end, x_start:x_end]
-                if sample_area.size == 0:
-                    self.logger.warning(f"Круг {i + 1} дал пустую область (size=0).")
-                    continue
-
-                avg_color = tuple(np.mean(sample_area, axis=(0, 1)).astype(int))
-                click_pos = (circle_x, circle_y)
-                palette_colors_data.append((avg_color, click_pos))
+            if self._sample_shape != palette_img.shape[:2]:
+                self._build_sample_regions(palette_img.shape[:2])
+            bounds = self._sample_bounds
+
+            # Средний цвет всех областей: одним JIT-ядром, иначе одной редукцией NumPy
+            # по областям одного размера; при разных размерах (обрезка у края) или крупных
+            # областях - четыре обращения к интегральному изображению на область
+            x0, y0, x1, y1 = bounds.T
+            areas = (x1 - x0) * (y1 - y0)
+            if NUMBA_AVAILABLE and len(bounds):
+                means = average_patches(np.ascontiguousarray(palette_img), bounds)
+            elif (len(set(zip(x1 - x0, y1 - y0))) <= 1 and
+                    areas.sum() * 4 <= palette_img.shape[0] * palette_img.shape[1]):
+                patches = [palette_img[ys:ye, xs:xe] for xs, ys, xe, ye in bounds.tolist()]
+                means = np.stack(patches).reshape(len(patches), -1, 3).mean(axis=1).astype(int) \
+                    if patches else np.empty((0, 3), int)
+            else:
+                sums = cv2.integral(palette_img).astype(np.int64)
+                totals = sums[y1, x1] - sums[y0, x1] - sums[y1, x0] + sums[y0, x0]
+                means = totals // areas[:, None]
+            palette_colors_data = [(tuple(avg_color), click) for avg_color, click in zip(means, self._sample_clicks)]
+            for i, (avg_color, click_pos) in enumerate(palette_colors_data):
                 self.logger.debug(f"Круг {i + 1}: Центр={click_pos}, Цвет={avg_color}")
 
-                if debug_palette_img is not None:
-                    cv2.rectangle(debug_palette_img, (x_start, y_start), (x_end, y_end), (255, 0, 0), 1)
-                    cv2.circle(debug_palette_img, (rel_x, rel_y), 3, (0, 0, 255), -1)
-
-            if debug_palette_img is not None:
+            if self.debug_tools.enabled:
+                debug_palette_img = palette_img.copy()
+                for x0, y0, x1, y1 in bounds.tolist():
+                    cv2.rectangle(debug_palette_img, (x0, y0), (x1, y1), (255, 0, 0), 1)
+                    cv2.circle(debug_palette_img, ((x0 + x1) // 2, (y0 + y1) // 2), 3, (0, 0, 255), -1)
                 self.debug_tools.show_image("Palette Extract - From Circles", debug_palette_img)
 
             if len(palette_colors_data) != num_colors_expected:
@@ -241,15 +492,36 @@ class PaletteAnalyzer:
             else:
                 sampled_colors = pixels_list
 
-            unique_colors = np.unique(sampled_colors, axis=0)
-            num_clusters = min(num_colors_expected, len(unique_colors)) if len(
-                unique_colors) < num_colors_expected else num_colors_expected
+            # Число различных цветов: цвет упаковывается в одно целое, уникальность по 1D-массиву
+            packed = (sampled_colors[:, 0].astype(np.uint32) << 16) | \
+                     (sampled_colors[:, 1].astype(np.uint32) << 8) | sampled_colors[:, 2]
+            num_clusters = min(num_colors_expected, len(np.unique(packed)))
 
-            cluster_centers, labels = self.kmeans_handler.cluster_colors(sampled_colors, num_clusters)
+            use_mmcq = self.fallback_quantizer == "mmcq" or (
+                self.fallback_quantizer == "auto" and num_clusters <= self.MMCQ_MAX_COLORS)
+            if use_mmcq:
+                cluster_centers = median_cut(sampled_colors, num_clusters)
+                num_clusters = len(cluster_centers)
+            else:
+                cluster_centers, labels = self.kmeans_handler.cluster_colors(sampled_colors, num_clusters)
+
+            # Позиции кластеров нужны лишь приблизительно: пиксели назначаются ближайшему
+            # центру на сетке с шагом PREDICT_STEP вместо predict по всему изображению
+            step = self.PREDICT_STEP
+            grid = palette_img[::step, ::step].reshape(-1, 3).astype(np.float32)
+            distances = ((grid[:, None, :] - cluster_centers[None, :, :].astype(np.float32)) ** 2).sum(axis=2)
+            all_labels = distances.argmin(axis=1)
             cluster_centers = cluster_centers.astype(int)
 
-            palette_coords = np.array([(y, x) for y in range(height) for x in range(width)])
-            all_labels = self.kmeans_handler.kmeans_handler.predict(pixels_list)
+            # Средние координаты кластеров: суммы y и x по меткам через bincount
+            if self._pixel_coords is None or self._pixel_coords[0] != (height, width):
+                grid_ys, grid_xs = np.arange(0, height, step), np.arange(0, width, step)
+                self._pixel_coords = ((height, width), np.repeat(grid_ys, len(grid_xs)),
+                                      np.tile(grid_xs, len(grid_ys)))
+            _, ys, xs = self._pixel_coords
+            counts = np.bincount(all_labels, minlength=num_clusters)
+            sum_y = np.bincount(all_labels, weights=ys, minlength=num_clusters)
+            sum_x = np.bincount(all_labels, weights=xs, minlength=num_clusters)
 
             palette_colors_data = []
             processed_centers = set()
@@ -260,13 +532,11 @@ class PaletteAnalyzer:
                 if center_color_tuple in processed_centers:
                     continue
 
-                cluster_pixel_indices = np.where(all_labels == i)[0]
-                if len(cluster_pixel_indices) == 0:
+                if counts[i] == 0:
                     self.logger.debug(f"Кластер {i} пуст.")
                     continue
 
-                cluster_coords = palette_coords[cluster_pixel_indices]
-                avg_y, avg_x = np.mean(cluster_coords, axis=0).astype(int)
+                avg_y, avg_x = int(sum_y[i] / counts[i]), int(sum_x[i] / counts[i])
                 screen_pos = (self.palette_top_left[0] + avg_x, self.palette_top_left[1] + avg_y)
 
                 palette_colors_data.append((center_color_tuple, screen_pos))
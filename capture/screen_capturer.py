@@ -1,14 +1,23 @@
 import logging
+import threading
 import numpy as np
 import mss
 import cv2
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple, Dict, List
 
 
 class ScreenCapturer:
-    """Класс для захвата экрана с поддержкой множественных мониторов"""
+    """
+    Класс для захвата экрана с поддержкой множественных мониторов.
+
+    Экземпляр mss создается один раз и переиспользуется всеми вызовами захвата.
+    mss не потокобезопасен: захват должен выполняться из потока, создавшего объект.
+    Параллельный захват всех мониторов использует отдельный экземпляр mss в каждом потоке пула.
+    """
 
     DEFAULT_MONITOR_INDEX = 0  # Основной монитор по умолчанию
+    REGION_CACHE_SIZE = 16  # Сколько проверенных областей capture_area хранить
 
     def __init__(self):
         """Инициализация захватчика экрана"""
@@ -16,8 +25,40 @@ class ScreenCapturer:
         self.sct = mss.mss()
         self.monitors = self._detect_monitors()
         self.selected_monitor_idx: Optional[int] = None
+        # Текущий монитор: обновляется в set_monitor, чтобы не выбирать его при каждом захвате
+        self._current_monitor: Optional[Dict[str, int]] = (
+            self.monitors[self.DEFAULT_MONITOR_INDEX] if self.monitors else None
+        )
+        # Проверенные области захвата по (top_left, bottom_right, монитор)
+        self._region_cache: Dict[Tuple, Dict[str, int]] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._tls = threading.local()
+        self._worker_scts: List[mss.base.MSSBase] = []  # Экземпляры mss потоков пула (для close)
+        self._worker_lock = threading.Lock()
         self.logger.debug("ScreenCapturer инициализирован")
 
+    def close(self) -> None:
+        """Освобождает ресурсы mss (дескрипторы X11/DXGI). Повторный вызов безопасен."""
+        pool = getattr(self, "_pool", None)
+        if pool is not None:
+            pool.shutdown(wait=True)
+            self._pool = None
+            with self._worker_lock:
+                for worker_sct in self._worker_scts:
+                    worker_sct.close()
+                self._worker_scts.clear()
+        sct = getattr(self, "sct", None)
+        if sct is not None:
+            sct.close()
+            self.sct = None
+            self.logger.debug("ScreenCapturer закрыт")
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
     def _detect_monitors(self) -> List[Dict[str, int]]:
         """
         Обнаруживает доступные мониторы
@@ -44,7 +85,7 @@ class ScreenCapturer:
         """
         if self._is_valid_monitor_index(monitor_idx):
             self.selected_monitor_idx = monitor_idx
-            monitor_info = self.monitors[monitor_idx]
+            monitor_info = self._current_monitor = self.monitors[monitor_idx]
             self.logger.info(f"Выбран монитор {monitor_idx}: "
                              f"{monitor_info['width']}x{monitor_info['height']} "
                              f"({monitor_info['left']},{monitor_info['top']})")
@@ -67,15 +108,68 @@ class ScreenCapturer:
                               f"Доступно: {len(self.monitors)}")
         return is_valid
 
-    def capture_fullscreen(self) -> Optional[np.ndarray]:
+    def capture_fullscreen(self, out: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
         """
         Захватывает весь экран выбранного монитора
 
+        Args:
+            out: Буфер (H, W, 3) uint8 для результата; используется, если размер совпадает.
+                 Вызывающий код не должен хранить прошлые кадры из этого буфера.
+
         Returns:
             RGB-изображение в формате numpy array, или None при ошибке
         """
         self.logger.debug("Выполняется захват всего экрана")
-        return self._capture_region()
+        return self._capture_region(out=out)
+
+    def capture_all_monitors(self) -> Optional[np.ndarray]:
+        """
+        Захватывает все физические мониторы параллельно и собирает их в один кадр.
+
+        Каждый монитор захватывается в потоке пула своим экземпляром mss, кадры
+        размещаются по координатам мониторов внутри общей области (монитор 0 в mss).
+
+        Returns:
+            RGB-изображение общей области, или None при ошибке
+        """
+        if len(self.monitors) < 2:
+            self.logger.error("Нет физических мониторов для захвата")
+            return None
+        physical = self.monitors[1:]
+        if len(physical) == 1:
+            return self._capture_region(**physical[0])
+
+        try:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=len(physical), thread_name_prefix="capture")
+            frames = list(self._pool.map(self._grab_in_worker, physical))
+        except Exception as e:
+            self.logger.error(f"Ошибка параллельного захвата мониторов: {str(e)}")
+            return None
+
+        union = self.monitors[0]
+        result = np.zeros((union['height'], union['width'], 3), dtype=np.uint8)
+        for monitor, frame in zip(physical, frames):
+            x, y = monitor['left'] - union['left'], monitor['top'] - union['top']
+            result[y:y + frame.shape[0], x:x + frame.shape[1]] = frame
+        return result
+
+    def _grab_in_worker(self, monitor: Dict[str, int]) -> np.ndarray:
+        """
+        Захват монитора в потоке пула собственным экземпляром mss этого потока
+
+        Args:
+            monitor: Информация о мониторе (top, left, width, height)
+
+        Returns:
+            RGB-изображение монитора
+        """
+        sct = getattr(self._tls, "sct", None)
+        if sct is None:
+            sct = self._tls.sct = mss.mss()
+            with self._worker_lock:
+                self._worker_scts.append(sct)
+        return self._convert_image(sct.grab(monitor))
 
     def capture_area(self,
                      top_left: Tuple[int, int],
@@ -97,27 +191,36 @@ class ScreenCapturer:
         """
         self.logger.debug(f"Захват области: {top_left} -> {bottom_right}")
 
-        monitor = self._get_current_monitor()
-        if not monitor:
-            return None
+        # Области палитры и холста постоянны: проверка и расчет выполняются один раз
+        key = (tuple(top_left), tuple(bottom_right), self.selected_monitor_idx)
+        region = self._region_cache.get(key)
+        if region is None:
+            monitor = self._get_current_monitor()
+            if not monitor:
+                return None
 
-        width = bottom_right[0] - top_left[0]
-        height = bottom_right[1] - top_left[1]
+            width = bottom_right[0] - top_left[0]
+            height = bottom_right[1] - top_left[1]
 
-        if not self._validate_dimensions(width, height):
-            return None
+            if not self._validate_dimensions(width, height):
+                return None
 
-        region = self._calculate_region_coordinates(top_left, width, height, monitor)
-        if not region:
-            return None
+            region = self._calculate_region_coordinates(top_left, width, height, monitor)
+            if not region:
+                return None
+
+            if len(self._region_cache) >= self.REGION_CACHE_SIZE:
+                self._region_cache.clear()
+            self._region_cache[key] = region
 
         return self._capture_region(**region)
 
-    def _capture_region(self, **kwargs) -> Optional[np.ndarray]:
+    def _capture_region(self, out: Optional[np.ndarray] = None, **kwargs) -> Optional[np.ndarray]:
         """
         Базовый метод захвата области с обработкой ошибок
 
         Args:
+            out: Необязательный буфер для результата (см. _convert_image)
             **kwargs: Параметры области захвата (top, left, width, height)
 
         Returns:
@@ -133,7 +236,7 @@ class ScreenCapturer:
             self.logger.debug(f"Захват региона: {region}")
 
             screenshot = self.sct.grab(region)
-            return self._convert_image(screenshot)
+            return self._convert_image(screenshot, out)
 
         except Exception as e:
             self.logger.error(f"Ошибка захвата: {str(e)} | Регион: {kwargs}")
@@ -146,9 +249,7 @@ class ScreenCapturer:
         Returns:
             Информация о мониторе или None
         """
-        if self.selected_monitor_idx is not None:
-            return self.monitors[self.selected_monitor_idx]
-        return self.monitors[self.DEFAULT_MONITOR_INDEX] if self.monitors else None
+        return self._current_monitor
 
     def _validate_dimensions(self, width: int, height: int) -> bool:
         """
@@ -184,22 +285,20 @@ class ScreenCapturer:
             Словарь с абсолютными координатами или None при ошибке
         """
         try:
+            monitor_left, monitor_top = monitor['left'], monitor['top']
+            monitor_width, monitor_height = monitor['width'], monitor['height']
+
             # Корректируем координаты относительно монитора
-            left = top_left[0] - monitor['left']
-            top = top_left[1] - monitor['top']
+            left = top_left[0] - monitor_left
+            top = top_left[1] - monitor_top
 
             # Проверяем выход за границы
-            if any([
-                left < 0,
-                top < 0,
-                left + width > monitor['width'],
-                top + height > monitor['height']
-            ]):
+            if left < 0 or top < 0 or left + width > monitor_width or top + height > monitor_height:
                 raise ValueError("Область выходит за пределы монитора")
 
             return {
-                'top': monitor['top'] + top,
-                'left': monitor['left'] + left,
+                'top': monitor_top + top,
+                'left': monitor_left + left,
                 'width': width,
                 'height': height
             }
@@ -208,16 +307,22 @@ class ScreenCapturer:
             self.logger.error(f"Ошибка расчета координат: {str(e)}")
             return None
 
-    def _convert_image(self, screenshot: mss.screenshot.ScreenShot) -> np.ndarray:
+    def _convert_image(self, screenshot: mss.screenshot.ScreenShot,
+                       out: Optional[np.ndarray] = None) -> np.ndarray:
         """
         Конвертирует изображение из формата mss в RGB-массив
 
         Args:
             screenshot: Объект скриншота от mss
+            out: Буфер (H, W, 3) uint8 для результата; при несовпадении размера выделяется новый массив
 
         Returns:
             RGB-массив в формате numpy
         """
-        # Удаляем альфа-канал и конвертируем цвета
-        image = np.array(screenshot)[:, :, :3]
-        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        # Представление сырого BGRA-буфера без копирования; отбрасывание альфа-канала
+        # и перестановка каналов выполняются одним проходом cvtColor (векторизованный
+        # путь OpenCV, заметно быстрее cv2.mixChannels с той же перестановкой)
+        bgra = np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(screenshot.height, screenshot.width, 4)
+        if out is not None and out.shape == (screenshot.height, screenshot.width, 3) and out.dtype == np.uint8:
+            return cv2.cvtColor(bgra, cv2.COLOR_BGRA2RGB, dst=out)
+        return cv2.cvtColor(bgra, cv2.COLOR_BGRA2RGB)
@@ -31,12 +31,13 @@ class AutoDrawer:
             if not self.capturer.set_monitor(monitor_idx):
                 self.logger.error("Неверный индекс монитора. Используется монитор по умолчанию (0).")
         self.canvas_detector = CanvasDetector(self.capturer, debug, config_loader=self.config)
-        self.palette_analyzer = PaletteAnalyzer(self.capturer, debug)
+        self.palette_analyzer = PaletteAnalyzer(self.capturer, debug, config_loader=self.config)
 
         self.image_processor = ImageProcessor(debug)
         self.color_matcher = ColorMatcher()
         self.mouse = MouseController(self.state, self.config)
         self.keyboard = KeyboardListener(self.state)
+        self.debug_tools = DebugTools(debug)
         self.process = ProcessController(
             state=self.state,
             mouse=self.mouse,
@@ -45,9 +46,9 @@ class AutoDrawer:
             image_processor=self.image_processor,
             color_matcher=self.color_matcher,
             config=self.config,
-            debug=debug
+            debug=debug,
+            debug_tools=self.debug_tools
         )
-        self.debug_tools = DebugTools(debug)
         self.keyboard.start()
         self.logger.info("AutoDrawer успешно инициализирован.")
 
@@ -78,7 +79,7 @@ class AutoDrawer:
             return False
 
     def run(self, input_path: str, clear_first: bool) -> None:
-        start_time = time.time()
+        start_time = time.perf_counter()
         self.logger.info("=" * 40)
         self.logger.info(f"Запуск AutoDrawer: {input_path}, очистка: {clear_first}")
         self.logger.info("=" * 40)
@@ -119,9 +120,10 @@ class AutoDrawer:
             self.state.stop()
         finally:
             self.keyboard.stop()
+            self.capturer.close()
             if self.debug:
                 self.debug_tools.cleanup()
-            end_time = time.time()
+            end_time = time.perf_counter()
             self.logger.info(f"Общее время выполнения: {end_time - start_time:.2f} секунд.")
             self.logger.info("Завершение работы AutoDrawer.")
 
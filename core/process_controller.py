@@ -1,6 +1,8 @@
 import logging
+import math
 import time
-from typing import Optional, Dict, List, Tuple, Set
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
 import numpy as np
 from tqdm import tqdm
 
@@ -13,7 +15,20 @@ from input.mouse_controller import MouseController
 from input.input_validator import InputValidator
 from utils.config_loader import ConfigLoader
 from utils.debug_tools import DebugTools
-from utils.helpers import optimize_drawing_order
+from utils.helpers import serpentine_order, unpack_rgb
+
+
+def rgb555_keys(codes: np.ndarray) -> np.ndarray:
+    """
+    Ключ таблицы RGB555 для упакованных цветов: (r>>3)<<10 | (g>>3)<<5 | (b>>3).
+
+    Args:
+        codes: Упакованные цвета r<<16 | g<<8 | b (N,) int32.
+
+    Returns:
+        np.ndarray: Ключи в диапазоне [0, 32768) (N,) int32.
+    """
+    return (((codes >> 19) & 0x1F) << 10) | (((codes >> 11) & 0x1F) << 5) | ((codes >> 3) & 0x1F)
 
 
 class ProcessController:
@@ -22,6 +37,13 @@ class ProcessController:
     Делегирует задачи соответствующим модулям.
     """
 
+    COLOR_LUT_SIZE = 1 << 15  # Размер таблицы RGB555 -> индекс позиции палитры
+    COLOR_LUT_MISSING = 255  # Значение в таблице для цветов без сопоставления
+    PROGRESS_MIN_INTERVAL = 0.25  # Минимальный интервал перерисовки индикатора прогресса (сек)
+    PROGRESS_MAX_REFRESHES = 500  # Ориентировочное число перерисовок индикатора за проход
+    COUNTDOWN_SECONDS = 5  # Отсчет перед началом очистки и рисования (сек)
+    COUNTDOWN_POLL_INTERVAL = 0.05  # Интервал проверки паузы и отмены во время отсчета (сек)
+
     def __init__(
             self,
             state: StateManager,
@@ -31,7 +53,8 @@ class ProcessController:
             image_processor: ImageProcessor,
             color_matcher: ColorMatcher,
             config: ConfigLoader,
-            debug: bool
+            debug: bool,
+            debug_tools: Optional[DebugTools] = None
     ):
         """
         Инициализация контроллера процесса.
@@ -45,6 +68,7 @@ class ProcessController:
             color_matcher: Сопоставление цветов.
             config: Конфигурация настроек.
             debug: Включение режима отладки.
+            debug_tools: Общий экземпляр DebugTools; если None, создается собственный.
         """
         self.logger = logging.getLogger(__name__)
         self.state = state
@@ -54,7 +78,7 @@ class ProcessController:
         self.image_processor = image_processor
         self.color_matcher = color_matcher
         self.config = config
-        self.debug_tools = DebugTools(debug)
+        self.debug_tools = debug_tools if debug_tools is not None else DebugTools(debug)
         self.validator = InputValidator()
 
         # Параметры, устанавливаемые в setup
@@ -62,6 +86,10 @@ class ProcessController:
         self.target_resolution_w: Optional[int] = None
         self.target_resolution_h: Optional[int] = None
 
+        # Задержки кликов, зафиксированные на время рисования и очистки
+        self._click_delay: float = float(self.config.get("click_delay", 0.5))
+        self._clear_click_delay: float = float(self.config.get("clear_click_delay", 0.5))
+
         self.logger.debug("ProcessController инициализирован.")
 
     def setup(self, clear_requested: bool) -> bool:
@@ -212,6 +240,9 @@ class ProcessController:
 
         if not self.state.is_running():
             return False
+        self._click_delay = float(self.config.get("click_delay"))
+        self._clear_click_delay = float(self.config.get("clear_click_delay"))
+        self.mouse.refresh_delays()
         self.logger.info(
             f"Скорость: клик={self.config.get('click_delay'):.3f}с, "
             f"смена цвета={self.config.get('color_change_delay'):.3f}с, "
@@ -234,7 +265,8 @@ class ProcessController:
             input_path,
             self.target_resolution_w,
             self.target_resolution_h,
-            self.state
+            self.state,
+            self.num_colors
         )
 
     def execute(self, input_path: str, clear_first: bool) -> None:
@@ -247,33 +279,185 @@ class ProcessController:
         """
         self.logger.info("Запуск процесса выполнения...")
 
-        # Пауза перед началом
-        print("-" * 40)
-        self.logger.info("Подготовка завершена. Переключитесь на окно для рисования!")
-        self.logger.info("Начало через 5 секунд... Нажмите ПРОБЕЛ для паузы или ESC для отмены.")
-        print("-" * 40)
-        for i in range(5, 0, -1):
-            print(f"...{i}")
-            time.sleep(1)
-            if not self.state.is_running():
-                self.logger.warning("Запуск отменен.")
-                return
-            if self.state.is_paused():
-                self.logger.info("Пауза активирована. Нажмите Пробел для старта.")
-                print("(Пауза активна. Нажмите Пробел для старта...)")
-                if not self.state.wait_while_paused():
+        # Загрузка и кластеризация изображения в фоне, пока идут отсчет и очистка холста.
+        # В режиме отладки ImageProcessor показывает окна OpenCV, поэтому загрузка остается в этом потоке.
+        loader: Optional[ThreadPoolExecutor] = None
+        pixels_future: Optional[Future] = None
+        if not self.image_processor.debug_tools.enabled:
+            loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pixel_loader")
+            pixels_future = loader.submit(self._load_input_pixels, input_path)
+
+        try:
+            # Пауза перед началом
+            print("-" * 40)
+            self.logger.info("Подготовка завершена. Переключитесь на окно для рисования!")
+            self.logger.info("Начало через 5 секунд... Нажмите ПРОБЕЛ для паузы или ESC для отмены.")
+            print("-" * 40)
+            # Отсчет короткими интервалами, чтобы пауза и отмена срабатывали без задержки
+            deadline = time.perf_counter() + self.COUNTDOWN_SECONDS
+            shown = None
+            remaining = float(self.COUNTDOWN_SECONDS)
+            while remaining > 0:
+                if shown != math.ceil(remaining):
+                    shown = math.ceil(remaining)
+                    print(f"...{shown}")
+                time.sleep(min(self.COUNTDOWN_POLL_INTERVAL, remaining))
+                if not self.state.is_running():
+                    self.logger.warning("Запуск отменен.")
+                    return
+                if self.state.is_paused():
+                    self.logger.info("Пауза активирована. Нажмите Пробел для старта.")
+                    print("(Пауза активна. Нажмите Пробел для старта...)")
+                    paused_at = time.perf_counter()
+                    if not self.state.wait_while_paused():
+                        return
+                    deadline += time.perf_counter() - paused_at
+                remaining = deadline - time.perf_counter()
+
+            # Очистка холста
+            if clear_first:
+                self.logger.info("Очистка холста...")
+                if not self.clear_canvas():
+                    self.logger.error("Очистка холста не удалась.")
                     return
 
-        # Очистка холста
-        if clear_first:
-            self.logger.info("Очистка холста...")
-            if not self.clear_canvas():
-                self.logger.error("Очистка холста не удалась.")
-                return
+            # Рисование
+            self.logger.info("Рисование изображения...")
+            pixels = pixels_future.result() if pixels_future is not None else None
+            self.draw_image(input_path, pixels)
+        finally:
+            if loader is not None:
+                loader.shutdown(wait=False)
+
+    def _load_input_pixels(self, input_path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Загрузка пикселей изображения с кластеризацией под текущие параметры.
+
+        Args:
+            input_path: Путь к изображению.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Столбцы, строки и упакованные цвета пикселей
+                (пустые массивы при ошибке).
+        """
+        return self.image_processor.get_input_pixels(
+            input_path,
+            self.target_resolution_w,
+            self.target_resolution_h,
+            self.num_colors
+        )[:3]
+
+    def _progress_bar(self, total: int, desc: str, unit: str) -> tqdm:
+        """
+        Индикатор прогресса для циклов кликов с редкой перерисовкой.
+
+        Args:
+            total: Общее количество шагов.
+            desc: Подпись индикатора.
+            unit: Единица измерения.
+
+        Returns:
+            tqdm: Индикатор прогресса.
+        """
+        return tqdm(total=total, desc=desc, unit=unit, mininterval=self.PROGRESS_MIN_INTERVAL,
+                    miniters=max(1, total // self.PROGRESS_MAX_REFRESHES), smoothing=0.05)
+
+    def _cell_screen_coords(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Вычисление экранных координат центров клеток холста.
+
+        Координаты считаются один раз для всех столбцов и строк сетки и
+        ограничиваются границами холста, чтобы в циклах рисования и очистки
+        оставалась только индексация.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Массивы X-координат столбцов и Y-координат строк (int32).
+        """
+        tl = self.canvas_detector.canvas_top_left
+        br = self.canvas_detector.canvas_bottom_right
+        cols = self.canvas_detector.cell_cols
+        rows = self.canvas_detector.cell_rows
+        step_x = (br[0] - tl[0]) / cols
+        step_y = (br[1] - tl[1]) / rows
+
+        screen_xs = np.clip((tl[0] + (np.arange(cols) + 0.5) * step_x).astype(np.int32), tl[0], br[0] - 1)
+        screen_ys = np.clip((tl[1] + (np.arange(rows) + 0.5) * step_y).astype(np.int32), tl[1], br[1] - 1)
+        return screen_xs, screen_ys
+
+    def _build_color_lut(self, unique_codes: np.ndarray, code_idx: np.ndarray,
+                         num_positions: int) -> Tuple[np.ndarray, int, bool]:
+        """
+        Построение таблицы «цвет -> индекс позиции палитры» для векторного поиска.
+
+        Основной вариант — uint8-таблица на 32768 ячеек RGB555. Если два цвета изображения
+        с разными позициями палитры попадают в одну ячейку (или позиций слишком много),
+        используется точная таблица по номеру цвета в отсортированном unique_codes.
+
+        Args:
+            unique_codes: Отсортированные упакованные цвета изображения.
+            code_idx: Индекс позиции палитры для каждого цвета из unique_codes (-1, если цвета нет).
+            num_positions: Количество позиций палитры.
+
+        Returns:
+            Tuple[np.ndarray, int, bool]: Таблица, значение для несопоставленных цветов
+                и признак точной таблицы.
+        """
+        if num_positions < self.COLOR_LUT_MISSING:
+            lut_idx = np.where(code_idx < 0, self.COLOR_LUT_MISSING, code_idx)
+            keys = rgb555_keys(unique_codes)
+            lut = np.full(self.COLOR_LUT_SIZE, self.COLOR_LUT_MISSING, dtype=np.uint8)
+            lut[keys] = lut_idx
+            if np.array_equal(lut[keys], lut_idx):
+                return lut, self.COLOR_LUT_MISSING, False
+
+        self.logger.debug("Коллизия цветов в таблице RGB555, используется точная таблица.")
+        return code_idx, -1, True
+
+    @staticmethod
+    def _color_keys(codes: np.ndarray, unique_codes: np.ndarray, exact: bool) -> np.ndarray:
+        """
+        Ключи цветов для таблицы из _build_color_lut.
+
+        Args:
+            codes: Упакованные цвета пикселей.
+            unique_codes: Отсортированные упакованные цвета изображения.
+            exact: Признак точной таблицы.
+
+        Returns:
+            np.ndarray: Индексы в таблице цветов.
+        """
+        return np.searchsorted(unique_codes, codes) if exact else rgb555_keys(codes)
+
+    def _skip_painted_cells(self, drawable: np.ndarray, xs: np.ndarray, ys: np.ndarray, pixel_idx: np.ndarray,
+                            palette_colors: np.ndarray, screen_xs: np.ndarray, screen_ys: np.ndarray) -> np.ndarray:
+        """
+        Исключение пикселей, клетки которых на холсте уже имеют нужный цвет палитры
+        (например, фон после очистки ластиком).
+
+        Args:
+            drawable: Индексы пикселей для рисования.
+            xs: Столбцы пикселей.
+            ys: Строки пикселей.
+            pixel_idx: Индекс цвета палитры для каждого пикселя.
+            palette_colors: Цвета палитры (K, 3) RGB.
+            screen_xs: Экранные X-координаты столбцов сетки.
+            screen_ys: Экранные Y-координаты строк сетки.
+
+        Returns:
+            np.ndarray: Индексы пикселей, которые нужно рисовать.
+        """
+        cell_colors = self.canvas_detector.sample_cell_colors(screen_xs, screen_ys)
+        if cell_colors is None or not len(drawable):
+            return drawable
+
+        # Цвет палитры, которым будет закрашен каждый пиксель, против текущего цвета его клетки
+        target = palette_colors[pixel_idx[drawable]]
+        current = cell_colors[ys[drawable], xs[drawable]].astype(np.int32)
+        tolerance = self.config.get("background_tolerance", 24)
+        painted = ((target - current) ** 2).sum(axis=1) <= tolerance * tolerance
 
-        # Рисование
-        self.logger.info("Рисование изображения...")
-        self.draw_image(input_path)
+        self.logger.info(f"Пропущено клеток с уже нужным цветом: {int(painted.sum())}")
+        return drawable[~painted]
 
     def clear_canvas(self) -> bool:
         """
@@ -290,55 +474,41 @@ class ProcessController:
         if not self.mouse.select_color(self.palette_analyzer.eraser_pos):
             return False
 
-        canvas_width = self.canvas_detector.canvas_bottom_right[0] - self.canvas_detector.canvas_top_left[0]
-        canvas_height = self.canvas_detector.canvas_bottom_right[1] - self.canvas_detector.canvas_top_left[1]
-        total_clicks = self.canvas_detector.cell_cols * self.canvas_detector.cell_rows
+        # Экранные координаты всех клеток построчно (X меняется быстрее)
+        screen_xs, screen_ys = self._cell_screen_coords()
+        grid_x, grid_y = np.meshgrid(screen_xs, screen_ys)
+        coords = np.stack([grid_x.ravel(), grid_y.ravel()], axis=1)
 
         self.logger.info(f"Очистка {self.canvas_detector.cell_cols}x{self.canvas_detector.cell_rows} клеток...")
-        with tqdm(total=total_clicks, desc="Очистка холста", unit="click") as pbar:
-            for y in range(self.canvas_detector.cell_rows):
-                for x in range(self.canvas_detector.cell_cols):
-                    if not self.state.wait_while_paused():
-                        self.logger.warning("Очистка прервана.")
-                        return False
-
-                    step_x = canvas_width / self.canvas_detector.cell_cols
-                    step_y = canvas_height / self.canvas_detector.cell_rows
-                    screen_x = int(self.canvas_detector.canvas_top_left[0] + x * step_x + step_x / 2)
-                    screen_y = int(self.canvas_detector.canvas_top_left[1] + y * step_y + step_y / 2)
-
-                    screen_x = min(max(screen_x, self.canvas_detector.canvas_top_left[0]),
-                                   self.canvas_detector.canvas_bottom_right[0] - 1)
-                    screen_y = min(max(screen_y, self.canvas_detector.canvas_top_left[1]),
-                                   self.canvas_detector.canvas_bottom_right[1] - 1)
-
-                    if not self.mouse.click(screen_x, screen_y, delay=self.config.get("clear_click_delay")):
-                        self.logger.error("Ошибка при очистке пикселя.")
-                        return False
-                    pbar.update(1)
+        with self._progress_bar(len(coords), "Очистка холста", "click") as pbar:
+            if not self.mouse.click_batch(coords, delay=self._clear_click_delay, on_progress=pbar.update):
+                if self.state.is_running():
+                    self.logger.error("Ошибка при очистке пикселя.")
+                else:
+                    self.logger.warning("Очистка прервана.")
+                return False
 
         self.logger.info("Очистка холста завершена.")
         return True
 
-    def draw_image(self, input_path: str) -> None:
+    def draw_image(self, input_path: str,
+                   pixels: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> None:
         """
         Рисование изображения на холсте.
 
         Args:
             input_path: Путь к изображению.
+            pixels: Заранее загруженные пиксели (столбцы, строки, упакованные цвета); если None, загружаются здесь.
         """
         if not self.canvas_detector.canvas_top_left or not self.canvas_detector.canvas_bottom_right:
             self.logger.error("Область холста не определена.")
             return
 
         # Загрузка пикселей изображения
-        pixels, img_w, img_h = self.image_processor.get_input_pixels(
-            input_path,
-            self.target_resolution_w,
-            self.target_resolution_h,
-            self.num_colors
-        )
-        if not pixels:
+        if pixels is None:
+            pixels = self._load_input_pixels(input_path)
+        xs, ys, pixel_codes = pixels
+        if not len(xs):
             self.logger.error("Не удалось загрузить пиксели изображения.")
             return
 
@@ -356,49 +526,69 @@ class ProcessController:
             return
         self.logger.info(f"Извлечено {len(palette_data)} цветов палитры.")
 
-        # Сопоставление цветов
-        unique_colors: Set[Tuple[int, int, int]] = set(p[2] for p in pixels)
-        color_map = self.color_matcher.map_colors(unique_colors, palette_data)
-        if not color_map:
+        # Сопоставление цветов: ближайший цвет палитры для каждого уникального цвета изображения
+        unique_codes = np.unique(pixel_codes)
+        palette_colors = np.array([color for color, _ in palette_data], dtype=np.int32).reshape(-1, 3)
+        palette_positions = [tuple(pos) for _, pos in palette_data]
+        code_idx = self.color_matcher.nearest_palette_indices(unpack_rgb(unique_codes), palette_colors)
+        if len(code_idx) != len(unique_codes):
             self.logger.error("Не удалось сопоставить цвета.")
             return
-
-        # Оптимизация порядка рисования
-        drawable_pixels = [p for p in pixels if p[2] in color_map]
-        optimized_pixels = optimize_drawing_order(drawable_pixels)
-        self.logger.info(f"Будет нарисовано {len(optimized_pixels)} из {len(pixels)} пикселей.")
-
-        # Рисование
-        canvas_width = self.canvas_detector.canvas_bottom_right[0] - self.canvas_detector.canvas_top_left[0]
-        canvas_height = self.canvas_detector.canvas_bottom_right[1] - self.canvas_detector.canvas_top_left[1]
-        step_x = canvas_width / self.canvas_detector.cell_cols
-        step_y = canvas_height / self.canvas_detector.cell_rows
-
-        with tqdm(total=len(optimized_pixels), desc="Рисование", unit="px") as pbar:
-            for x, y, color in optimized_pixels:
-                if not self.state.wait_while_paused():
+        self.logger.info(f"Сопоставлено {len(unique_codes)} цветов изображения с {len(palette_data)} цветами палитры.")
+        color_lut, lut_missing, exact_lut = self._build_color_lut(unique_codes, code_idx.astype(np.int32),
+                                                                  len(palette_positions))
+
+        # Группировка пикселей по позиции цвета в палитре (каждый цвет выбирается один раз),
+        # внутри группы — обход «змейкой» по строкам
+        screen_xs, screen_ys = self._cell_screen_coords()
+        pixel_idx = color_lut[self._color_keys(pixel_codes, unique_codes, exact_lut)].astype(np.int32)
+        drawable = np.flatnonzero(pixel_idx != lut_missing)
+        if self.config.get("skip_background", False):
+            drawable = self._skip_painted_cells(drawable, xs, ys, pixel_idx, palette_colors, screen_xs, screen_ys)
+        order = drawable[serpentine_order(xs[drawable], ys[drawable], pixel_idx[drawable])]
+        self.logger.info(f"Пиксели сгруппированы по {len(np.unique(pixel_idx[drawable]))} цветам палитры.")
+        self.logger.info(f"Будет нарисовано {len(order)} из {len(xs)} пикселей.")
+
+        # План рисования: координаты и индекс позиции палитры для каждого пикселя
+        plan_x, plan_y, plan_idx = screen_xs[xs[order]], screen_ys[ys[order]], pixel_idx[order]
+
+        # Рисование: методы и задержка связываются с локальными именами до цикла
+        current_pos: Optional[Tuple[int, int]] = None
+        wait = self.state.wait_while_paused
+        resumed = self.state.resume_event.is_set
+        stopped = self.state.stop_event.is_set
+        select = self.mouse.select_color
+        click = self.mouse.click
+        delay = self._click_delay
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        with self._progress_bar(len(order), "Рисование", "px") as pbar:
+            update = pbar.update
+            for i, (screen_x, screen_y, palette_idx) in enumerate(
+                    zip(plan_x.tolist(), plan_y.tolist(), plan_idx.tolist())):
+                # Пауза проверяется флагом события; остановку также ловит click
+                if (not resumed() and not wait()) or ((i & 63) == 0 and stopped()):
                     self.logger.warning("Рисование прервано.")
                     return
 
-                palette_pos = color_map.get(color)
-                if not palette_pos:
-                    pbar.update(1)
-                    continue
-
-                if not self.mouse.select_color(palette_pos):
-                    self.logger.error("Ошибка выбора цвета.")
-                    return
-
-                screen_x = int(self.canvas_detector.canvas_top_left[0] + x * step_x + step_x / 2)
-                screen_y = int(self.canvas_detector.canvas_top_left[1] + y * step_y + step_y / 2)
-                screen_x = min(max(screen_x, self.canvas_detector.canvas_top_left[0]),
-                               self.canvas_detector.canvas_bottom_right[0] - 1)
-                screen_y = min(max(screen_y, self.canvas_detector.canvas_top_left[1]),
-                               self.canvas_detector.canvas_bottom_right[1] - 1)
-
-                if not self.mouse.click(screen_x, screen_y, delay=self.config.get("click_delay")):
-                    self.logger.error("Ошибка рисования пикселя.")
+                palette_pos = palette_positions[palette_idx]
+                if palette_pos != current_pos:
+                    if not select(palette_pos):
+                        if stopped():
+                            self.logger.warning("Рисование прервано.")
+                        else:
+                            self.logger.error("Ошибка выбора цвета.")
+                        return
+                    current_pos = palette_pos
+                    if debug:
+                        self.logger.debug("Смена цвета: позиция палитры %s, пиксель %d из %d", palette_pos, i + 1,
+                                          len(order))
+
+                if not click(screen_x, screen_y, delay=delay):
+                    if stopped():
+                        self.logger.warning("Рисование прервано.")
+                    else:
+                        self.logger.error("Ошибка рисования пикселя.")
                     return
-                pbar.update(1)
+                update(1)
 
         self.logger.info("Рисование завершено.")
@@ -1,7 +1,6 @@
 import threading
 import logging
-import time
-from typing import Optional
+from typing import Callable, List, Optional
 
 
 class StateManager:
@@ -15,9 +14,27 @@ class StateManager:
         self.logger = logging.getLogger(__name__)
         self._running: bool = True
         self._paused: bool = False
-        self._lock = threading.Lock()
+        # Условие защищает флаги и будит ожидающих при смене паузы или остановке
+        self._cond = threading.Condition()
+        # События для горячих циклов: установлено, пока нет паузы (или программа остановлена),
+        # и установлено после остановки
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._stop_event = threading.Event()
+        # Обработчики, вызываемые при остановке (например, остановка слушателей ввода)
+        self._stop_callbacks: List[Callable[[], object]] = []
         self.logger.debug("StateManager инициализирован.")
 
+    @property
+    def resume_event(self) -> threading.Event:
+        """Событие, установленное, пока программа не на паузе (или уже остановлена)."""
+        return self._resume_event
+
+    @property
+    def stop_event(self) -> threading.Event:
+        """Событие, установленное после остановки программы."""
+        return self._stop_event
+
     def is_running(self) -> bool:
         """
         Проверяет, запущена ли программа.
@@ -25,31 +42,73 @@ class StateManager:
         Returns:
             bool: True, если программа работает, иначе False.
         """
-        with self._lock:
-            return self._running
+        # Чтение флага события не берет блокировку; записи идут под условием
+        return not self._stop_event.is_set()
 
     def is_paused(self) -> bool:
         """
         Проверяет, приостановлена ли программа.
 
         Returns:
-            bool: True, если программа на паузе, иначе False.
+            bool: True, если программа на паузе (и не остановлена), иначе False.
+        """
+        return not self._resume_event.is_set()
+
+    def add_stop_callback(self, callback: Callable[[], object]) -> None:
+        """
+        Регистрирует обработчик остановки программы.
+
+        Если программа уже остановлена, обработчик вызывается сразу.
+
+        Args:
+            callback: Функция без аргументов, вызываемая при остановке.
         """
-        with self._lock:
-            return self._paused
+        with self._cond:
+            if self._running:
+                self._stop_callbacks.append(callback)
+                return
+        callback()
+
+    def remove_stop_callback(self, callback: Callable[[], object]) -> None:
+        """
+        Удаляет ранее зарегистрированный обработчик остановки.
+
+        Args:
+            callback: Обработчик, переданный в add_stop_callback.
+        """
+        with self._cond:
+            if callback in self._stop_callbacks:
+                self._stop_callbacks.remove(callback)
 
     def stop(self) -> None:
         """Останавливает программу."""
-        with self._lock:
-            if self._running:
-                self._running = False
-                self._paused = False
-                self.logger.info("Программа остановлена.")
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._paused = False
+            self._stop_event.set()
+            self._resume_event.set()
+            self._cond.notify_all()
+            callbacks, self._stop_callbacks = self._stop_callbacks, []
+            self.logger.info("Программа остановлена.")
+
+        # Обработчики вызываются вне блокировки: они могут обращаться к StateManager
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                self.logger.exception(f"Ошибка обработчика остановки: {e}")
 
     def toggle_pause(self) -> None:
         """Переключает состояние паузы."""
-        with self._lock:
+        with self._cond:
             self._paused = not self._paused
+            if self._paused and self._running:
+                self._resume_event.clear()
+            else:
+                self._resume_event.set()
+            self._cond.notify_all()
             status = "приостановлена" if self._paused else "возобновлена"
             self.logger.info(f"Программа {status}.")
 
@@ -60,9 +119,9 @@ class StateManager:
         Returns:
             bool: True, если программа возобновлена, False, если остановлена.
         """
-        while self.is_paused():
-            if not self.is_running():
-                self.logger.warning("Ожидание прервано: программа остановлена.")
-                return False
-            time.sleep(0.1)
-        return self.is_running()
+        with self._cond:
+            if self._paused:
+                self._cond.wait_for(lambda: not self._paused or not self._running)
+                if not self._running:
+                    self.logger.warning("Ожидание прервано: программа остановлена.")
+            return self._running
@@ -1,8 +1,45 @@
 import logging
 import numpy as np
+import cv2
 from typing import Set, Dict, Tuple, List
-from skimage.color import rgb2lab
-from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
+
+from utils.jit import njit, prange, NUMBA_AVAILABLE
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def nearest_lab(image_lab: np.ndarray, palette_lab: np.ndarray) -> np.ndarray:
+    """
+    Индекс ближайшего цвета палитры для каждого цвета изображения одним проходом
+    (квадрат евклидова расстояния и argmin без промежуточной матрицы N×K).
+
+    Args:
+        image_lab: Цвета изображения (N, 3) LAB float32.
+        palette_lab: Цвета палитры (K, 3) LAB float32, K > 0.
+
+    Returns:
+        np.ndarray: Индексы ближайших цветов палитры (N,) int32.
+    """
+    n, m = image_lab.shape[0], palette_lab.shape[0]
+    out = np.empty(n, np.int32)
+    for i in prange(n):
+        # Начальное значение - расстояние до первого цвета: при fastmath
+        # сравнение с бесконечностью не определено
+        dl = image_lab[i, 0] - palette_lab[0, 0]
+        da = image_lab[i, 1] - palette_lab[0, 1]
+        db = image_lab[i, 2] - palette_lab[0, 2]
+        best = dl * dl + da * da + db * db
+        best_idx = 0
+        for j in range(1, m):
+            dl = image_lab[i, 0] - palette_lab[j, 0]
+            da = image_lab[i, 1] - palette_lab[j, 1]
+            db = image_lab[i, 2] - palette_lab[j, 2]
+            d = dl * dl + da * da + db * db
+            if d < best:
+                best = d
+                best_idx = j
+        out[i] = best_idx
+    return out
 
 
 class ColorMatcher:
@@ -41,23 +78,18 @@ class ColorMatcher:
             palette_colors = np.array([color for color, _ in palette_data])
             palette_positions = [pos for _, pos in palette_data]
 
-            # Преобразование в LAB для точного сравнения
-            image_colors_array = np.array(list(image_colors), dtype=np.uint8)
-            palette_colors_array = palette_colors.astype(np.uint8)
-
-            image_lab = rgb2lab(image_colors_array.reshape(-1, 1, 3)).reshape(-1, 3)
-            palette_lab = rgb2lab(palette_colors_array.reshape(-1, 1, 3)).reshape(-1, 3)
-
-            # Вычисление расстояний между цветами
-            distances = cdist(image_lab, palette_lab, metric="euclidean")
-            nearest_indices = np.argmin(distances, axis=1)
+            image_colors_list = list(image_colors)
+            nearest_indices = self.nearest_palette_indices(np.array(image_colors_list), palette_colors)
+            if len(nearest_indices) != len(image_colors_list):
+                return color_map
 
             # Формирование словаря сопоставления
-            for i, img_color in enumerate(image_colors):
-                palette_idx = nearest_indices[i]
+            debug = self.logger.isEnabledFor(logging.DEBUG)
+            for img_color, palette_idx in zip(image_colors_list, nearest_indices.tolist()):
                 color_map[img_color] = palette_positions[palette_idx]
-                self.logger.debug(
-                    f"Сопоставлен цвет {img_color} -> {palette_colors[palette_idx]} @ {palette_positions[palette_idx]}")
+                if debug:
+                    self.logger.debug(
+                        f"Сопоставлен цвет {img_color} -> {palette_colors[palette_idx]} @ {palette_positions[palette_idx]}")
 
             self.logger.info(f"Сопоставлено {len(color_map)} цветов.")
             return color_map
@@ -65,3 +97,54 @@ class ColorMatcher:
         except Exception as e:
             self.logger.exception(f"Ошибка сопоставления цветов: {e}")
             return color_map
+
+    def nearest_palette_indices(self, image_colors: np.ndarray, palette_colors: np.ndarray) -> np.ndarray:
+        """
+        Индексы ближайших цветов палитры для массива цветов изображения (расстояние в LAB).
+
+        Args:
+            image_colors: Цвета изображения (N, 3) RGB.
+            palette_colors: Цвета палитры (K, 3) RGB.
+
+        Returns:
+            np.ndarray: Индекс ближайшего цвета палитры для каждого цвета изображения (N,),
+                или пустой массив при ошибке.
+        """
+        if not len(image_colors) or not len(palette_colors):
+            self.logger.warning("Пустой массив цветов или палитра.")
+            return np.array([], dtype=np.intp)
+
+        try:
+            # Преобразование в LAB для точного сравнения
+            image_lab = self._rgb_to_lab(image_colors)
+            palette_lab = self._rgb_to_lab(palette_colors)
+
+            if NUMBA_AVAILABLE:
+                return nearest_lab(image_lab, palette_lab).astype(np.intp)
+
+            # Поиск ближайшего соседа по KD-дереву палитры: N·log K вместо полной матрицы N×K
+            tree = cKDTree(palette_lab)
+            _, nearest_indices = tree.query(image_lab, k=1, workers=-1)
+            return np.asarray(nearest_indices, dtype=np.intp)
+
+        except Exception as e:
+            self.logger.exception(f"Ошибка поиска ближайших цветов палитры: {e}")
+            return np.array([], dtype=np.intp)
+
+    @staticmethod
+    def _rgb_to_lab(colors: np.ndarray) -> np.ndarray:
+        """
+        Преобразование RGB в CIE LAB (D65) через cv2.cvtColor.
+
+        Вход переводится в float32 [0, 1]: для него OpenCV возвращает L в [0, 100] и a, b без
+        смещения, как skimage. У uint8-варианта L растянута до [0, 255], что меняет вес яркости
+        в расстоянии и, значит, выбор ближайшего цвета.
+
+        Args:
+            colors: Цвета (N, 3) RGB в диапазоне 0-255.
+
+        Returns:
+            np.ndarray: Цвета (N, 3) LAB float32.
+        """
+        rgb = np.asarray(colors, dtype=np.float32).reshape(1, -1, 3) / 255.0
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB).reshape(-1, 3)
@@ -1,12 +1,15 @@
 import logging
+import math
+import os
 import numpy as np
 from PIL import Image
 import cv2
-from typing import Optional, Tuple, List, Set
+from typing import Any, Optional, Tuple, Set
 
 from core.state_manager import StateManager
 from utils.debug_tools import DebugTools
 from image_processing.kmeans_handler import KMeansHandler
+from utils.helpers import pack_rgb, unpack_rgb
 
 
 class ImageProcessor:
@@ -24,13 +27,37 @@ class ImageProcessor:
         self.logger = logging.getLogger(__name__)
         self.debug_tools = DebugTools(debug)
         self.kmeans_handler = KMeansHandler()
+        # Результаты последнего уменьшения и извлечения пикселей: предпросмотр и рисование
+        # работают с одним и тем же изображением и параметрами
+        self._downsample_cache: Optional[Tuple[Tuple[Any, ...], Tuple[np.ndarray, int, int]]] = None
+        self._pixels_cache: Optional[Tuple[Tuple[Any, ...], Tuple[np.ndarray, np.ndarray, np.ndarray, int, int]]] = None
         self.logger.debug("ImageProcessor инициализирован.")
 
+    @staticmethod
+    def _file_key(path: str) -> Tuple[str, float]:
+        """
+        Ключ кэша для файла: путь и время изменения.
+
+        Args:
+            path: Путь к файлу изображения.
+
+        Returns:
+            Tuple[str, float]: Абсолютный путь и время изменения (-1.0, если файл недоступен).
+        """
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = -1.0
+        return os.path.abspath(path), mtime
+
     def downsample_image(self, path: str, target_width: int, target_height: int) -> Tuple[
         Optional[np.ndarray], int, int]:
         """
         Уменьшает изображение до целевого размера с сохранением пропорций.
 
+        Результат последнего вызова кэшируется по пути, времени изменения файла и размеру;
+        возвращаемый массив доступен только для чтения.
+
         Args:
             path: Путь к файлу изображения.
             target_width: Целевая ширина (в пикселях или ячейках).
@@ -39,32 +66,113 @@ class ImageProcessor:
         Returns:
             Tuple[Optional[np.ndarray], int, int]: Уменьшенное изображение, его ширина и высота, или (None, 0, 0) при ошибке.
         """
+        key = (self._file_key(path), target_width, target_height)
+        if self._downsample_cache is not None and self._downsample_cache[0] == key:
+            self.logger.debug("Используется уменьшенное изображение из кэша.")
+            return self._downsample_cache[1]
+
         self.logger.info(f"Уменьшение изображения {path} до {target_width}x{target_height}...")
         try:
-            with Image.open(path) as img:
-                # Преобразование в RGB (удаляем альфа-канал, если есть)
-                img_rgb = img.convert("RGB")
-                img_thumb = img_rgb.copy()
-
-                # Уменьшение с сохранением пропорций
-                img_thumb.thumbnail((target_width, target_height), Image.Resampling.LANCZOS)
-                img_array = np.array(img_thumb)
+            img_array = self._load_thumbnail_cv2(path, target_width, target_height)
+            if img_array is None:
+                self.logger.debug("OpenCV не прочитал файл, используется PIL.")
+                img_array = self._load_thumbnail_pil(path, target_width, target_height)
 
-                # Коррекция ориентации, если ширина больше высоты
-                if img_array.shape[1] > img_array.shape[0]:
-                    img_array = np.rot90(img_array)
-                    self.logger.info("Изображение повернуто на 90° для соответствия холсту.")
+            # Коррекция ориентации, если ширина больше высоты
+            if img_array.shape[1] > img_array.shape[0]:
+                img_array = np.rot90(img_array)
+                self.logger.info("Изображение повернуто на 90° для соответствия холсту.")
 
-                self.logger.info(f"Итоговый размер: {img_array.shape[1]}x{img_array.shape[0]}")
-                if self.debug_tools.enabled:
-                    self.debug_tools.show_image("Downsampled Image", img_array)
+            self.logger.info(f"Итоговый размер: {img_array.shape[1]}x{img_array.shape[0]}")
+            if self.debug_tools.enabled:
+                self.debug_tools.show_image("Downsampled Image", img_array)
 
-                return img_array, img_array.shape[1], img_array.shape[0]
+            # Кэшированный массив разделяется между вызовами: запрещаем его изменение
+            img_array.setflags(write=False)
+            result = (img_array, img_array.shape[1], img_array.shape[0])
+            self._downsample_cache = (key, result)
+            return result
         except Exception as e:
             self.logger.exception(f"Ошибка уменьшения изображения {path}: {e}")
             return None, 0, 0
 
-    def preview_image(self, path: str, target_width: int, target_height: int, state: StateManager) -> bool:
+    @staticmethod
+    def _thumbnail_size(width: int, height: int, target_width: int, target_height: int) -> Tuple[int, int]:
+        """
+        Размер уменьшенного изображения по тем же правилам, что и PIL Image.thumbnail.
+
+        Args:
+            width: Исходная ширина.
+            height: Исходная высота.
+            target_width: Максимальная ширина.
+            target_height: Максимальная высота.
+
+        Returns:
+            Tuple[int, int]: Новые ширина и высота (исходные, если изображение уже помещается).
+        """
+        x, y = math.floor(target_width), math.floor(target_height)
+        if x >= width and y >= height:
+            return width, height
+
+        def round_aspect(number: float, key) -> int:
+            return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+        aspect = width / height
+        if x / y >= aspect:
+            x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+        else:
+            y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+        return x, y
+
+    def _load_thumbnail_cv2(self, path: str, target_width: int, target_height: int) -> Optional[np.ndarray]:
+        """
+        Загрузка и уменьшение изображения средствами OpenCV (cv2.resize INTER_AREA).
+
+        Файл читается через np.fromfile + cv2.imdecode, чтобы поддерживать пути с не-ASCII
+        символами; EXIF-ориентация игнорируется, как и при загрузке через PIL.
+
+        Args:
+            path: Путь к файлу изображения.
+            target_width: Целевая ширина.
+            target_height: Целевая высота.
+
+        Returns:
+            Optional[np.ndarray]: RGB-изображение, или None, если OpenCV не поддерживает формат.
+        """
+        data = np.fromfile(path, dtype=np.uint8)
+        img = cv2.imdecode(data, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if img is None:
+            return None
+
+        height, width = img.shape[:2]
+        new_w, new_h = self._thumbnail_size(width, height, target_width, target_height)
+        if (new_w, new_h) != (width, height):
+            img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    @staticmethod
+    def _load_thumbnail_pil(path: str, target_width: int, target_height: int) -> np.ndarray:
+        """
+        Загрузка и уменьшение изображения через PIL (для форматов, которые не читает OpenCV).
+
+        Args:
+            path: Путь к файлу изображения.
+            target_width: Целевая ширина.
+            target_height: Целевая высота.
+
+        Returns:
+            np.ndarray: RGB-изображение.
+        """
+        with Image.open(path) as img:
+            # Преобразование в RGB (удаляем альфа-канал, если есть)
+            img_thumb = img.convert("RGB")
+
+            # Уменьшение с сохранением пропорций
+            img_thumb.thumbnail((target_width, target_height), Image.Resampling.LANCZOS)
+            return np.array(img_thumb)
+
+    def preview_image(self, path: str, target_width: int, target_height: int, state: StateManager,
+                      num_colors: int = 10) -> bool:
         """
         Создает и показывает предпросмотр изображения, запрашивает подтверждение.
 
@@ -73,6 +181,7 @@ class ImageProcessor:
             target_width: Целевая ширина.
             target_height: Целевая высота.
             state: Экземпляр StateManager для проверки состояния.
+            num_colors: Количество цветов для кластеризации (как при рисовании).
 
         Returns:
             bool: True, если пользователь подтвердил, False, если отменил или произошла ошибка.
@@ -80,24 +189,18 @@ class ImageProcessor:
         self.logger.info("Создание предпросмотра изображения...")
         print("\n--- Предпросмотр ---")
         try:
-            # Уменьшение изображения
-            downsampled_img, w, h = self.downsample_image(path, target_width, target_height)
-            if downsampled_img is None:
-                self.logger.error("Не удалось создать предпросмотр: изображение не уменьшено.")
-                return False
-
-            # Кластеризация цветов (для точного предпросмотра)
-            pixels = self.get_input_pixels(path, target_width, target_height, num_colors=10)[0]
-            if not pixels:
+            # Уменьшение и кластеризация цветов (для точного предпросмотра); изображение
+            # загружается один раз, результат затем переиспользуется при рисовании
+            xs, ys, rgb, w, h = self.get_input_pixels(path, target_width, target_height, num_colors)
+            if not len(xs):
                 self.logger.error("Не удалось извлечь пиксели для предпросмотра.")
                 return False
 
             # Создание изображения предпросмотра
             preview_img = np.zeros((h, w, 3), dtype=np.uint8)
-            for x, y, color in pixels:
-                preview_img[y, x] = color
+            preview_img[ys, xs] = unpack_rgb(rgb)
 
-            self.debug_tools.show_image("Предпросмотр", preview_img, wait_key=False)
+            self.debug_tools.show_image("Предпросмотр", preview_img, wait_ms=None)
             self.logger.info(f"Показан предпросмотр: {w}x{h}")
 
             print("Проверьте предпросмотр:")
@@ -127,10 +230,12 @@ class ImageProcessor:
             return False
 
     def get_input_pixels(self, path: str, target_width: int, target_height: int, num_colors: int) -> Tuple[
-        List[Tuple[int, int, Tuple[int, int, int]]], int, int]:
+        np.ndarray, np.ndarray, np.ndarray, int, int]:
         """
         Извлекает пиксели изображения с кластеризацией цветов.
 
+        Пиксели возвращаются параллельными массивами в построчном порядке.
+
         Args:
             path: Путь к файлу изображения.
             target_width: Целевая ширина.
@@ -138,37 +243,48 @@ class ImageProcessor:
             num_colors: Количество цветов для кластеризации.
 
         Returns:
-            Tuple[List[Tuple[int, int, Tuple[int, int, int]]], int, int]:
-                Список (x, y, цвет RGB), ширина и высота изображения, или ([], 0, 0) при ошибке.
+            Tuple[np.ndarray, np.ndarray, np.ndarray, int, int]:
+                Столбцы (int32), строки (int32), упакованные цвета r<<16 | g<<8 | b (uint32),
+                ширина и высота изображения, или пустые массивы и (0, 0) при ошибке.
         """
+        key = (self._file_key(path), target_width, target_height, num_colors)
+        if self._pixels_cache is not None and self._pixels_cache[0] == key:
+            self.logger.info("Используются пиксели изображения из кэша.")
+            return self._pixels_cache[1]
+
         self.logger.info(f"Извлечение пикселей из {path} с {num_colors} цветами...")
+        empty = (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint32), 0, 0)
         try:
             # Уменьшение изображения
             img, w, h = self.downsample_image(path, target_width, target_height)
             if img is None:
-                return [], 0, 0
+                return empty
 
-            # Подготовка пикселей для кластеризации
-            pixels = img.reshape(-1, 3)
-            unique_colors = np.unique(pixels, axis=0)
+            # Подготовка пикселей для кластеризации: кластеризуются уникальные цвета
+            # с весами по числу пикселей, метки пикселей берутся через обратный индекс
+            codes, inverse, counts = np.unique(pack_rgb(img.reshape(-1, 3)), return_inverse=True,
+                                               return_counts=True)
+            unique_colors = unpack_rgb(codes)
             num_clusters = min(num_colors, len(unique_colors))
             self.logger.info(f"Уникальных цветов: {len(unique_colors)}, кластеров: {num_clusters}")
 
             # Кластеризация
-            cluster_centers, labels = self.kmeans_handler.cluster_colors(pixels, num_clusters)
-            cluster_centers = cluster_centers.astype(int)
+            cluster_centers, labels = self.kmeans_handler.cluster_colors(unique_colors, num_clusters, counts)
+            if not len(cluster_centers):
+                return empty
+            cluster_codes = pack_rgb(cluster_centers.astype(int))
+
+            # Формирование массивов пикселей
+            ys, xs = np.divmod(np.arange(h * w, dtype=np.int32), w)
+            rgb = cluster_codes[labels][inverse]
 
-            # Формирование списка пикселей
-            input_pixels = []
-            for i in range(h):
-                for j in range(w):
-                    pixel_idx = i * w + j
-                    color = tuple(cluster_centers[labels[pixel_idx]])
-                    input_pixels.append((j, i, color))
+            for array in (xs, ys, rgb):
+                array.setflags(write=False)
 
-            self.logger.info(f"Извлечено {len(input_pixels)} пикселей, цветов: {num_clusters}")
-            return input_pixels, w, h
+            self.logger.info(f"Извлечено {len(rgb)} пикселей, цветов: {num_clusters}")
+            self._pixels_cache = (key, (xs, ys, rgb, w, h))
+            return xs, ys, rgb, w, h
 
         except Exception as e:
             self.logger.exception(f"Ошибка извлечения пикселей: {e}")
-            return [], 0, 0
+            return empty
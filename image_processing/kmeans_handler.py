@@ -1,27 +1,38 @@
 import logging
 import numpy as np
-from sklearn.cluster import KMeans
-from typing import Tuple
+import cv2
+from typing import Optional, Tuple
 
 
 class KMeansHandler:
     """
     Класс для кластеризации цветов с использованием K-Means.
+
+    Кластеризация выполняется cv2.kmeans (float32, один запуск с инициализацией k-means++),
+    что заметно быстрее многократных перезапусков sklearn KMeans.
     """
 
+    MAX_ITER = 10  # Максимум итераций Ллойда
+    EPSILON = 1.0  # Порог сдвига центров для остановки (в единицах RGB)
+    ATTEMPTS = 1  # Количество запусков с разной инициализацией
+    RANDOM_SEED = 0  # Зерно генератора OpenCV для воспроизводимых результатов
+
     def __init__(self):
         """Инициализация обработчика K-Means."""
         self.logger = logging.getLogger(__name__)
-        self.kmeans_handler = None  # Для хранения модели после обучения
+        self.cluster_centers: Optional[np.ndarray] = None  # Центры после обучения (для predict)
         self.logger.debug("KMeansHandler инициализирован.")
 
-    def cluster_colors(self, pixels: np.ndarray, num_clusters: int) -> Tuple[np.ndarray, np.ndarray]:
+    def cluster_colors(self, pixels: np.ndarray, num_clusters: int,
+                       weights: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
         """
         Выполняет кластеризацию цветов с помощью K-Means.
 
         Args:
             pixels: Массив пикселей (N, 3) в формате RGB.
             num_clusters: Количество кластеров (цветов).
+            weights: Необязательные веса точек (N,), например число пикселей каждого уникального цвета.
+                     С весами результат соответствует кластеризации всех исходных пикселей.
 
         Returns:
             Tuple[np.ndarray, np.ndarray]: Центры кластеров и метки для каждого пикселя, или (пустой массив, пустой массив) при ошибке.
@@ -32,19 +43,56 @@ class KMeansHandler:
                 self.logger.warning(f"Число пикселей ({pixels.shape[0]}) меньше числа кластеров ({num_clusters}).")
                 num_clusters = max(1, pixels.shape[0])
 
-            kmeans = KMeans(n_clusters=num_clusters, random_state=0, n_init="auto")
-            labels = kmeans.fit_predict(pixels)
-            self.kmeans_handler = kmeans  # Сохраняем модель для возможного предсказания
+            pixels32 = np.ascontiguousarray(pixels, dtype=np.float32)
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, self.MAX_ITER, self.EPSILON)
+            cv2.setRNGSeed(self.RANDOM_SEED)
+            _, labels, centers = cv2.kmeans(pixels32, num_clusters, None, criteria,
+                                            self.ATTEMPTS, cv2.KMEANS_PP_CENTERS)
+            labels = labels.ravel()
+            if weights is not None:
+                centers, labels = self._refine_weighted(pixels32, weights, centers, labels)
+            self.cluster_centers = centers  # Сохраняем центры для возможного предсказания
             self.logger.info(f"Кластеризация завершена: {num_clusters} кластеров.")
-            return kmeans.cluster_centers_, labels
+            return centers, labels
 
         except Exception as e:
             self.logger.exception(f"Ошибка кластеризации: {e}")
             return np.array([]), np.array([])
 
+    def _refine_weighted(self, points: np.ndarray, weights: np.ndarray, centers: np.ndarray,
+                         labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Уточняет центры взвешенными итерациями Ллойда (cv2.kmeans не принимает веса).
+
+        Args:
+            points: Точки (N, 3) float32.
+            weights: Веса точек (N,).
+            centers: Начальные центры (K, 3) float32.
+            labels: Начальные метки (N,).
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Уточненные центры и метки.
+        """
+        num_clusters = len(centers)
+        weights = np.asarray(weights, dtype=np.float64)
+        for _ in range(self.MAX_ITER):
+            total = np.bincount(labels, weights=weights, minlength=num_clusters)
+            new_centers = centers.copy()
+            filled = total > 0  # Пустые кластеры сохраняют прежний центр
+            for channel in range(3):
+                sums = np.bincount(labels, weights=weights * points[:, channel], minlength=num_clusters)
+                new_centers[filled, channel] = sums[filled] / total[filled]
+            shift = np.abs(new_centers - centers).max()
+            centers = new_centers
+            diff = points[:, None, :] - centers[None, :, :]
+            labels = np.einsum("ijk,ijk->ij", diff, diff).argmin(axis=1)
+            if shift < self.EPSILON:
+                break
+        return centers, labels
+
     def predict(self, pixels: np.ndarray) -> np.ndarray:
         """
-        Предсказывает метки кластеров для новых пикселей на основе обученной модели.
+        Предсказывает метки кластеров для новых пикселей по ближайшему центру.
 
         Args:
             pixels: Массив пикселей (N, 3) в формате RGB.
@@ -52,12 +100,13 @@ class KMeansHandler:
         Returns:
             np.ndarray: Метки кластеров или пустой массив при ошибке.
         """
-        if self.kmeans_handler is None:
+        if self.cluster_centers is None:
             self.logger.error("Модель K-Means не обучена.")
             return np.array([])
 
         try:
-            labels = self.kmeans_handler.predict(pixels)
+            diff = np.asarray(pixels, dtype=np.float32)[:, None, :] - self.cluster_centers[None, :, :]
+            labels = np.einsum("ijk,ijk->ij", diff, diff).argmin(axis=1)
             self.logger.debug(f"Предсказано {len(labels)} меток.")
             return labels
         except Exception as e:
@@ -1,18 +1,70 @@
 import logging
+import sys
 import time
+import numpy as np
 import pyautogui
-from typing import Optional, Tuple
+from typing import Callable, Optional, Tuple
 from pynput import mouse
 
 from core.state_manager import StateManager
 from utils.config_loader import ConfigLoader
 
+if sys.platform == "win32":
+    import ctypes
+
+    _MOUSEEVENTF_MOVE = 0x0001
+    _MOUSEEVENTF_LEFTDOWN = 0x0002
+    _MOUSEEVENTF_LEFTUP = 0x0004
+    _MOUSEEVENTF_VIRTUALDESK = 0x4000
+    _MOUSEEVENTF_ABSOLUTE = 0x8000
+    _INPUT_MOUSE = 0
+
+    class _MouseInput(ctypes.Structure):
+        _fields_ = [("dx", ctypes.c_long), ("dy", ctypes.c_long), ("mouseData", ctypes.c_ulong),
+                    ("dwFlags", ctypes.c_ulong), ("time", ctypes.c_ulong), ("dwExtraInfo", ctypes.c_size_t)]
+
+    class _Input(ctypes.Structure):
+        _fields_ = [("type", ctypes.c_ulong), ("mi", _MouseInput)]
+
+    def _send_clicks(coords: np.ndarray) -> bool:
+        """
+        Отправка серии кликов одним вызовом SendInput (перемещение, нажатие, отпускание на клик).
+
+        Args:
+            coords: Экранные координаты кликов (N, 2).
+
+        Returns:
+            bool: True, если система приняла все события.
+        """
+        user32 = ctypes.windll.user32
+        left, top = user32.GetSystemMetrics(76), user32.GetSystemMetrics(77)  # SM_X/YVIRTUALSCREEN
+        width, height = user32.GetSystemMetrics(78), user32.GetSystemMetrics(79)  # SM_CX/CYVIRTUALSCREEN
+
+        # Абсолютные координаты SendInput нормированы в диапазон 0..65535 по виртуальному экрану
+        norm_x = ((coords[:, 0] - left) * 65535 // max(width - 1, 1)).tolist()
+        norm_y = ((coords[:, 1] - top) * 65535 // max(height - 1, 1)).tolist()
+        move = _MOUSEEVENTF_MOVE | _MOUSEEVENTF_ABSOLUTE | _MOUSEEVENTF_VIRTUALDESK
+
+        events = (_Input * (3 * len(norm_x)))()
+        for i, (dx, dy) in enumerate(zip(norm_x, norm_y)):
+            events[3 * i].type = _INPUT_MOUSE
+            events[3 * i].mi.dx, events[3 * i].mi.dy, events[3 * i].mi.dwFlags = dx, dy, move
+            events[3 * i + 1].type = _INPUT_MOUSE
+            events[3 * i + 1].mi.dwFlags = _MOUSEEVENTF_LEFTDOWN
+            events[3 * i + 2].type = _INPUT_MOUSE
+            events[3 * i + 2].mi.dwFlags = _MOUSEEVENTF_LEFTUP
+        return user32.SendInput(len(events), events, ctypes.sizeof(_Input)) == len(events)
+else:
+    _send_clicks = None
+
 
 class MouseController:
     """
     Класс для управления мышью: клики, выбор областей, выбор цвета.
     """
 
+    CLICK_BATCH_SIZE = 512  # Кликов в одном вызове SendInput при нулевой задержке
+
     def __init__(self, state: StateManager, config: ConfigLoader):
         """
         Инициализация контроллера мыши.
@@ -28,11 +80,25 @@ class MouseController:
         self.click_coords: Optional[Tuple[int, int]] = None
         self.area_coords: Optional[Tuple[Tuple[int, int], Tuple[int, int]]] = None
 
-        # Настройка pyautogui
+        # Настройка pyautogui: встроенная пауза после каждого вызова отключена,
+        # темп кликов задается только явной задержкой в click
         pyautogui.FAILSAFE = True
-        pyautogui.PAUSE = config.get("failsafe_delay", 0.01)
+        pyautogui.PAUSE = 0
+        self._failsafe_delay: float = 0.01
+        self._color_change_delay: float = 0.08
+        self.refresh_delays()
         self.logger.debug("MouseController инициализирован.")
 
+    def refresh_delays(self) -> None:
+        """
+        Перечитывает задержки из конфигурации.
+
+        Задержки хранятся в атрибутах, а не читаются из конфигурации при каждом клике;
+        метод нужно вызвать после изменения конфигурации (config.update).
+        """
+        self._failsafe_delay = float(self.config.get("failsafe_delay", 0.01))
+        self._color_change_delay = float(self.config.get("color_change_delay", 0.08))
+
     def _on_click(self, x: int, y: int, button: mouse.Button, pressed: bool) -> bool:
         """
         Обработчик кликов мыши для слушателя.
@@ -68,7 +134,12 @@ class MouseController:
 
         with mouse.Listener(on_click=self._on_click) as listener:
             self.click_listener = listener
-            listener.join()
+            # Остановка программы сразу завершает слушатель, не дожидаясь клика
+            self.state.add_stop_callback(listener.stop)
+            try:
+                listener.join()
+            finally:
+                self.state.remove_stop_callback(listener.stop)
 
         if not self.state.is_running():
             self.logger.warning("Получение клика отменено (программа остановлена).")
@@ -139,14 +210,63 @@ class MouseController:
                 return False
 
         try:
-            self.logger.debug(f"Клик мыши: ({x}, {y})")
+            # click вызывается для каждого пикселя: строка отладки формируется только при DEBUG
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(f"Клик мыши: ({x}, {y})")
             pyautogui.click(x, y)
-            time.sleep(delay if delay is not None else self.config.get("failsafe_delay", 0.01))
+            pause = self._failsafe_delay if delay is None else delay
+            if pause > 0:
+                time.sleep(pause)
             return True
         except Exception as e:
             self.logger.exception(f"Ошибка клика ({x}, {y}): {e}")
             return False
 
+    def click_batch(self, coords: np.ndarray, delay: Optional[float] = None,
+                    on_progress: Optional[Callable[[int], object]] = None) -> bool:
+        """
+        Выполняет серию кликов по массиву координат.
+
+        На Windows при нулевой задержке клики отправляются пачками по CLICK_BATCH_SIZE
+        одним вызовом SendInput; в остальных случаях используется click для каждой точки.
+
+        Args:
+            coords: Экранные координаты кликов (N, 2) int32.
+            delay: Задержка после каждого клика (сек), если None — используется failsafe_delay.
+            on_progress: Вызывается с количеством выполненных кликов после каждого клика или пачки.
+
+        Returns:
+            bool: True, если все клики выполнены, False при ошибке или остановке.
+        """
+        if _send_clicks is None or delay != 0:
+            click = self.click
+            for x, y in coords.tolist():
+                if not click(x, y, delay=delay):
+                    return False
+                if on_progress is not None:
+                    on_progress(1)
+            return True
+
+        for start in range(0, len(coords), self.CLICK_BATCH_SIZE):
+            if not self.state.is_running():
+                self.logger.warning("Серия кликов отменена: программа остановлена.")
+                return False
+            if self.state.is_paused() and not self.state.wait_while_paused():
+                return False
+
+            chunk = coords[start:start + self.CLICK_BATCH_SIZE].astype(np.int64)
+            try:
+                pyautogui.failSafeCheck()
+                if not _send_clicks(chunk):
+                    self.logger.error(f"SendInput принял не все события пачки из {len(chunk)} кликов.")
+                    return False
+            except Exception as e:
+                self.logger.exception(f"Ошибка пакетного клика: {e}")
+                return False
+            if on_progress is not None:
+                on_progress(len(chunk))
+        return True
+
     def select_color(self, position: Tuple[int, int]) -> bool:
         """
         Выбирает цвет на палитре кликом.
@@ -157,8 +277,9 @@ class MouseController:
         Returns:
             bool: True, если выбор успешен, False при ошибке или остановке.
         """
-        self.logger.debug(f"Выбор цвета на позиции {position}...")
-        if not self.click(position[0], position[1], delay=self.config.get("color_change_delay", 0.08)):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"Выбор цвета на позиции {position}...")
+        if not self.click(position[0], position[1], delay=self._color_change_delay):
             self.logger.error(f"Не удалось выбрать цвет на {position}.")
             return False
         return True
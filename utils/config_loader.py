@@ -1,6 +1,105 @@
+import copy
+import functools
 import logging
-import yaml
-from typing import Any, Dict
+import os
+from types import MappingProxyType
+from typing import Any, Dict, Optional
+
+_MISSING = object()  # Маркер отсутствующего ключа в ConfigLoader.get
+_MIN_POSITIVE = 1e-6  # Нижняя граница для дробных параметров, которые должны быть строго больше нуля
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_load(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """
+    Читает и разбирает YAML-файл; результат запоминается по пути и времени изменения файла.
+
+    Args:
+        path: Абсолютный путь к файлу конфигурации.
+        mtime_ns: Время изменения файла (нс), входит в ключ кэша: правка файла инвалидирует запись.
+
+    Returns:
+        Dict[str, Any]: Разобранная конфигурация (не изменять: объект общий для всех вызовов).
+    """
+    # yaml импортируется только при фактическом чтении файла
+    import yaml
+
+    # Парсер на C (libyaml), если PyYAML собран с ним; иначе чистый Python
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    # Файл читается целиком одним вызовом; байты UTF-8 декодирует сам парсер
+    with open(path, "rb") as f:
+        data = f.read()
+    return yaml.load(data, Loader=loader) or {}
+
+
+# Значения по умолчанию (только для чтения); _load_config копирует их перед слиянием с файлом
+_DEFAULTS = MappingProxyType({
+    "target_width": 100,
+    "num_colors": 10,
+    "click_delay": 0.5,
+    "color_change_delay": 0.08,
+    "clear_click_delay": 0.5,
+    "failsafe_delay": 0.01,
+    "skip_background": False,
+    "background_tolerance": 24,
+    "canvas_detection": MappingProxyType({
+        "search_offset_y_ratio": 0.3,
+        "adaptive_thresh_block_size": 11,
+        "adaptive_thresh_c": 2,
+        "morph_kernel_size": 3,
+        "morph_iterations": 1,
+        "cell_min_aspect_ratio": 0.8,
+        "cell_max_aspect_ratio": 1.2,
+        "cell_min_width": 5,
+        "cell_max_width": 100,
+        "cell_min_height": 5,
+        "cell_max_height": 100,
+        "assume_portrait": True,
+        "fallback_cell_size": 20,
+        "downscale_factor": 0.5,
+        "fast_gray": False,
+        "threshold_mode": "gaussian",
+        "template_roi": False,
+        "use_opencl": False,
+    }),
+    "palette_detection": MappingProxyType({
+        "circle_detector": "hough",
+        "ring_min_fill": 0.3,
+        "downscale_factor": 0.5,
+        "fallback_quantizer": "auto",
+    }),
+})
+
+# Числовые и логические параметры разделов: (раздел, ключ, тип, значение по умолчанию,
+# минимум, максимум, только нечетные); границы включительные, None - без ограничения
+_RANGE_SPECS = (
+    ("canvas_detection", "search_offset_y_ratio", float, 0.3, 0.0, 1.0, False),
+    ("canvas_detection", "adaptive_thresh_block_size", int, 11, 5, None, True),
+    ("canvas_detection", "adaptive_thresh_c", int, 2, 0, 10, False),
+    ("canvas_detection", "morph_kernel_size", int, 3, 1, None, True),
+    ("canvas_detection", "morph_iterations", int, 1, 1, None, False),
+    ("canvas_detection", "cell_min_aspect_ratio", float, 0.8, 0.5, 1.0, False),
+    ("canvas_detection", "cell_max_aspect_ratio", float, 1.2, 1.0, 2.0, False),
+    ("canvas_detection", "cell_min_width", int, 5, 1, None, False),
+    ("canvas_detection", "cell_max_width", int, 100, None, None, False),
+    ("canvas_detection", "cell_min_height", int, 5, 1, None, False),
+    ("canvas_detection", "cell_max_height", int, 100, None, None, False),
+    ("canvas_detection", "assume_portrait", bool, True, None, None, False),
+    ("canvas_detection", "fallback_cell_size", int, 20, 1, None, False),
+    ("canvas_detection", "downscale_factor", float, 0.5, _MIN_POSITIVE, 1.0, False),
+    ("canvas_detection", "fast_gray", bool, False, None, None, False),
+    ("canvas_detection", "template_roi", bool, False, None, None, False),
+    ("canvas_detection", "use_opencl", bool, False, None, None, False),
+    ("palette_detection", "ring_min_fill", float, 0.3, _MIN_POSITIVE, 1.0, False),
+    ("palette_detection", "downscale_factor", float, 0.5, _MIN_POSITIVE, 1.0, False),
+)
+
+# Строковые параметры с фиксированным набором значений: (раздел, ключ, допустимые значения, по умолчанию)
+_CHOICE_SPECS = (
+    ("canvas_detection", "threshold_mode", ("gaussian", "mean_integral"), "gaussian"),
+    ("palette_detection", "circle_detector", ("hough", "ring"), "hough"),
+    ("palette_detection", "fallback_quantizer", ("auto", "mmcq", "kmeans"), "auto"),
+)
 
 
 class ConfigLoader:
@@ -8,6 +107,8 @@ class ConfigLoader:
     Класс для загрузки, валидации и управления конфигурацией.
     """
 
+    __slots__ = ("logger", "config", "_flat")
+
     def __init__(self, config_path: str = "config/settings.yaml"):
         """
         Инициализация загрузчика конфигурации.
@@ -18,6 +119,8 @@ class ConfigLoader:
         self.logger = logging.getLogger(__name__)
         self.config: Dict[str, Any] = self._load_config(config_path)
         self._validate_config()
+        # Плоское представление {"раздел.ключ": значение} для get; перестраивается в update
+        self._flat: Dict[str, Any] = self._flatten(self.config)
         self.logger.debug("ConfigLoader инициализирован.")
 
     def _load_config(self, path: str) -> Dict[str, Any]:
@@ -30,32 +133,12 @@ class ConfigLoader:
         Returns:
             Dict[str, Any]: Словарь с настройками.
         """
-        default_config = {
-            "target_width": 100,
-            "num_colors": 10,
-            "click_delay": 0.5,
-            "color_change_delay": 0.08,
-            "clear_click_delay": 0.5,
-            "failsafe_delay": 0.01,
-            "canvas_detection": {
-                "search_offset_y_ratio": 0.3,
-                "adaptive_thresh_block_size": 11,
-                "adaptive_thresh_c": 2,
-                "morph_kernel_size": 3,
-                "morph_iterations": 1,
-                "cell_min_aspect_ratio": 0.8,
-                "cell_max_aspect_ratio": 1.2,
-                "cell_min_width": 5,
-                "cell_max_width": 100,
-                "cell_min_height": 5,
-                "cell_max_height": 100,
-                "assume_portrait": True,
-                "fallback_cell_size": 20,
-            }
-        }
+        default_config = {key: dict(value) if isinstance(value, MappingProxyType) else value
+                          for key, value in _DEFAULTS.items()}
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                loaded_config = yaml.safe_load(f) or {}
+            full_path = os.path.abspath(path)
+            # Копия: кэшированный объект не должен меняться при слиянии и update
+            loaded_config = copy.deepcopy(_cached_load(full_path, os.stat(full_path).st_mtime_ns))
             self._update_nested_dict(default_config, loaded_config)
             self.logger.info(f"Конфигурация загружена из {path}")
         except FileNotFoundError:
@@ -64,58 +147,95 @@ class ConfigLoader:
             self.logger.exception(f"Ошибка загрузки конфигурации из {path}: {e}")
         return default_config
 
+    @staticmethod
+    def clear_cache() -> None:
+        """Сбрасывает кэш разобранных файлов конфигурации."""
+        _cached_load.cache_clear()
+
     def _update_nested_dict(self, default: Dict, update: Dict) -> None:
         """
-        Рекурсивно обновляет словарь default значениями из update.
+        Обновляет вложенный словарь default значениями из update (обход стеком, без рекурсии).
 
         Args:
             default: Исходный словарь.
             update: Словарь с новыми значениями.
         """
-        for key, value in update.items():
-            if isinstance(value, dict) and key in default and isinstance(default[key], dict):
-                self._update_nested_dict(default[key], value)
-            else:
-                default[key] = value
+        stack = [(default, update)]
+        while stack:
+            target, source = stack.pop()
+            for key, value in source.items():
+                current = target.get(key)
+                if type(value) is dict and type(current) is dict:
+                    stack.append((current, value))
+                else:
+                    target[key] = value
 
-    def _validate_config(self) -> None:
+    def _validate_config(self, changes: Optional[Dict[str, Any]] = None) -> None:
         """
         Проверяет корректность конфигурации, логирует предупреждения при некорректных значениях.
+
+        Args:
+            changes: Изменения из update; если заданы, проверяются только затронутые ключи
+                     (раздел, замененный не словарем, проверяется целиком).
         """
+        def touched(key: str) -> bool:
+            return changes is None or key in changes
+
+        def section_touched(section: str, key: str) -> bool:
+            if changes is None:
+                return True
+            delta = changes.get(section, _MISSING)
+            return delta is not _MISSING and (not isinstance(delta, dict) or key in delta)
+
         # Проверка основных параметров
-        if not isinstance(self.config.get("target_width"), int) or self.config["target_width"] <= 0:
+        if touched("target_width") and (
+                not isinstance(self.config.get("target_width"), int) or self.config["target_width"] <= 0):
             self.logger.warning("Некорректное значение target_width. Установлено по умолчанию: 100")
             self.config["target_width"] = 100
-        if not isinstance(self.config.get("num_colors"), int) or self.config["num_colors"] <= 0:
+        if touched("num_colors") and (
+                not isinstance(self.config.get("num_colors"), int) or self.config["num_colors"] <= 0):
             self.logger.warning("Некорректное значение num_colors. Установлено по умолчанию: 10")
             self.config["num_colors"] = 10
         for delay in ["click_delay", "color_change_delay", "clear_click_delay", "failsafe_delay"]:
-            if not isinstance(self.config.get(delay), (int, float)) or self.config[delay] <= 0:
+            if touched(delay) and (not isinstance(self.config.get(delay), (int, float)) or self.config[delay] <= 0):
                 self.logger.warning(f"Некорректное значение {delay}. Установлено по умолчанию: 0.5")
                 self.config[delay] = 0.5
+        if touched("skip_background") and not isinstance(self.config.get("skip_background"), bool):
+            self.logger.warning("Некорректное значение skip_background. Установлено по умолчанию: False")
+            self.config["skip_background"] = False
+        tolerance = self.config.get("background_tolerance")
+        if touched("background_tolerance") and (
+                not isinstance(tolerance, int) or isinstance(tolerance, bool) or not 0 <= tolerance <= 441):
+            self.logger.warning("Некорректное значение background_tolerance. Установлено по умолчанию: 24")
+            self.config["background_tolerance"] = 24
 
-        # Проверка параметров canvas_detection
+        # Проверка параметров разделов по таблицам _RANGE_SPECS и _CHOICE_SPECS
+        for section, key, type_, default, low, high, odd_only in _RANGE_SPECS:
+            if not section_touched(section, key):
+                continue
+            values = self.config.get(section, {})
+            value = values.get(key)
+            if (not isinstance(value, type_) or (low is not None and value < low) or
+                    (high is not None and value > high) or (odd_only and value % 2 == 0)):
+                self.logger.warning(f"Некорректное значение {section}.{key}. Установлено: {default}")
+                values[key] = default
+        for section, key, choices, default in _CHOICE_SPECS:
+            if not section_touched(section, key):
+                continue
+            values = self.config.get(section, {})
+            if values.get(key) not in choices:
+                self.logger.warning(f"Некорректное значение {section}.{key}. Установлено: {default}")
+                values[key] = default
+
+        # Максимальный размер ячейки зависит от уже проверенного минимального
         canvas = self.config.get("canvas_detection", {})
-        validations = {
-            "search_offset_y_ratio": (float, lambda x: 0.0 <= x <= 1.0, 0.3),
-            "adaptive_thresh_block_size": (int, lambda x: x > 3 and x % 2 == 1, 11),
-            "adaptive_thresh_c": (int, lambda x: 0 <= x <= 10, 2),
-            "morph_kernel_size": (int, lambda x: x > 0 and x % 2 == 1, 3),
-            "morph_iterations": (int, lambda x: x >= 1, 1),
-            "cell_min_aspect_ratio": (float, lambda x: 0.5 <= x <= 1.0, 0.8),
-            "cell_max_aspect_ratio": (float, lambda x: 1.0 <= x <= 2.0, 1.2),
-            "cell_min_width": (int, lambda x: x > 0, 5),
-            "cell_max_width": (int, lambda x: x > canvas.get("cell_min_width", 5), 100),
-            "cell_min_height": (int, lambda x: x > 0, 5),
-            "cell_max_height": (int, lambda x: x > canvas.get("cell_min_height", 5), 100),
-            "assume_portrait": (bool, lambda x: True, True),
-            "fallback_cell_size": (int, lambda x: x > 0, 20),
-        }
-        for key, (type_, condition, default) in validations.items():
-            value = canvas.get(key)
-            if not isinstance(value, type_) or not condition(value):
-                self.logger.warning(f"Некорректное значение canvas_detection.{key}. Установлено: {default}")
-                canvas[key] = default
+        for dimension in ("width", "height"):
+            max_key, min_key = f"cell_max_{dimension}", f"cell_min_{dimension}"
+            if not (section_touched("canvas_detection", max_key) or section_touched("canvas_detection", min_key)):
+                continue
+            if canvas.get(max_key) <= canvas.get(min_key, 5):
+                self.logger.warning(f"Некорректное значение canvas_detection.{max_key}. Установлено: 100")
+                canvas[max_key] = 100
 
     def get(self, key: str, default: Any = None) -> Any:
         """
@@ -128,18 +248,37 @@ class ConfigLoader:
         Returns:
             Any: Значение настройки или default.
         """
-        keys = key.split(".")
-        value = self.config
-        for k in keys:
-            value = value.get(k, {})
-            if value == {}:
+        value = self._flat.get(key, _MISSING)
+        # get вызывается часто: строки отладки формируются только при включенном уровне DEBUG
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        if value is _MISSING:
+            if debug:
                 self.logger.debug(f"Ключ {key} не найден. Возвращено: {default}")
-                return default
-        if value == {}:
-            value = default
-        self.logger.debug(f"Получено значение: {key} = {value}")
+            return default
+        if debug:
+            self.logger.debug(f"Получено значение: {key} = {value}")
         return value
 
+    @staticmethod
+    def _flatten(config: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+        """
+        Строит плоский словарь путей: каждому ключу и разделу соответствует запись "a.b.c".
+
+        Args:
+            config: Словарь конфигурации (возможно, вложенный).
+            prefix: Префикс пути для вложенных разделов.
+
+        Returns:
+            Dict[str, Any]: Словарь {путь через точку: значение}; разделы входят в него как словари.
+        """
+        flat: Dict[str, Any] = {}
+        for key, value in config.items():
+            path = f"{prefix}{key}"
+            flat[path] = value
+            if isinstance(value, dict):
+                flat.update(ConfigLoader._flatten(value, f"{path}."))
+        return flat
+
     def update(self, new_config: Dict[str, Any]) -> None:
         """
         Обновляет конфигурацию новыми значениями.
@@ -148,5 +287,8 @@ class ConfigLoader:
             new_config: Словарь с новыми значениями.
         """
         self._update_nested_dict(self.config, new_config)
-        self._validate_config()
-        self.logger.debug(f"Конфигурация обновлена: {new_config}")
+        # Проверяются только измененные ключи: остальные уже проверены при загрузке
+        self._validate_config(new_config)
+        self._flat = self._flatten(self.config)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"Конфигурация обновлена: {new_config}")
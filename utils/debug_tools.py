@@ -9,6 +9,10 @@ class DebugTools:
     Класс для инструментов отладки с OpenCV.
     """
 
+    __slots__ = ("logger", "enabled", "windows_open")
+
+    WAIT_MS = 1  # Опрос клавиатуры в show_image по умолчанию (мс): окно обновляется без блокировки
+
     def __init__(self, debug: bool = False):
         """
         Инициализация инструментов отладки.
@@ -24,14 +28,15 @@ class DebugTools:
         else:
             self.logger.debug("DebugTools отключены.")
 
-    def show_image(self, window_name: str, image: np.ndarray, wait_key: bool = True) -> None:
+    def show_image(self, window_name: str, image: np.ndarray, wait_ms: Optional[int] = WAIT_MS) -> None:
         """
         Показывает изображение в окне OpenCV.
 
         Args:
             window_name: Название окна.
             image: Изображение (RGB или grayscale).
-            wait_key: Ожидать нажатия клавиши (True) или показать без блокировки (False).
+            wait_ms: Ожидание клавиши (мс): по умолчанию короткий опрос без блокировки (окно остается
+                     открытым), 0 — ждать нажатия и закрыть окно, None — не вызывать cv2.waitKey.
         """
         if not self.enabled:
             return
@@ -41,25 +46,36 @@ class DebugTools:
             return
 
         try:
-            # Преобразование в BGR для OpenCV, если RGB
-            display_img = image.copy()
-            if len(image.shape) == 3 and image.shape[2] == 3:
+            # Преобразование в BGR для OpenCV, если RGB; остальные изображения показываются
+            # без копирования (imshow не изменяет переданный массив)
+            if image.ndim == 3 and image.shape[2] == 3:
                 display_img = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            else:
+                display_img = image
 
             cv2.imshow(window_name, display_img)
             self.windows_open.add(window_name)
             self.logger.debug(f"Показ изображения: {window_name}, размер={image.shape}")
 
-            if wait_key:
-                key = cv2.waitKey(0)
+            if wait_ms is not None:
+                key = cv2.waitKey(wait_ms) & 0xFF
                 if key == ord('q') or key == 27:  # 'q' или ESC
                     self.cleanup()
-                else:
+                elif wait_ms == 0:
                     cv2.destroyWindow(window_name)
                     self.windows_open.discard(window_name)
         except Exception as e:
             self.logger.exception(f"Ошибка отображения {window_name}: {e}")
 
+    def pause(self) -> None:
+        """Блокирует выполнение до нажатия клавиши в окне OpenCV; 'q' или ESC закрывают все окна."""
+        if not self.enabled or not self.windows_open:
+            return
+
+        key = cv2.waitKey(0) & 0xFF
+        if key == ord('q') or key == 27:  # 'q' или ESC
+            self.cleanup()
+
     def cleanup(self) -> None:
         """Закрывает все открытые окна OpenCV."""
         if not self.enabled:
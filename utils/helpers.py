@@ -1,22 +1,47 @@
-import logging
-from typing import List, Tuple
+import numpy as np
+from typing import Optional
 
 
-def optimize_drawing_order(pixels: List[Tuple[int, int, Tuple[int, int, int]]]) -> List[
-    Tuple[int, int, Tuple[int, int, int]]]:
+def serpentine_order(xs: np.ndarray, ys: np.ndarray, groups: Optional[np.ndarray] = None) -> np.ndarray:
     """
-    Оптимизирует порядок рисования пикселей для минимизации переключения цветов.
+    Порядок обхода пикселей «змейкой»: по строкам сверху вниз, четные строки слева направо,
+    нечетные — справа налево. Линейный проход без попарных расстояний.
 
     Args:
-        pixels: Список пикселей [(x, y, (r, g, b))].
+        xs: Столбцы пикселей (N,).
+        ys: Строки пикселей (N,).
+        groups: Номера групп (N,); если заданы, пиксели сначала упорядочиваются по группе.
 
     Returns:
-        List[Tuple[int, int, Tuple[int, int, int]]]: Отсортированный список пикселей.
+        np.ndarray: Индексы пикселей в порядке обхода (N,).
     """
-    logger = logging.getLogger(__name__)
-    logger.debug(f"Оптимизация порядка для {len(pixels)} пикселей...")
+    x_key = np.where(ys & 1, -xs, xs)
+    keys = (x_key, ys) if groups is None else (x_key, ys, groups)
+    return np.lexsort(keys)
 
-    # Сортировка по цвету, затем по y, затем по x
-    sorted_pixels = sorted(pixels, key=lambda p: (p[2], p[1], p[0]))
-    logger.debug("Оптимизация порядка завершена.")
-    return sorted_pixels
+
+def pack_rgb(colors: np.ndarray) -> np.ndarray:
+    """
+    Упаковка RGB-цветов в одно целое число r<<16 | g<<8 | b.
+
+    Args:
+        colors: Массив цветов (N, 3).
+
+    Returns:
+        np.ndarray: Упакованные цвета (N,) uint32.
+    """
+    colors = colors.astype(np.uint32, copy=False)
+    return (colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]
+
+
+def unpack_rgb(codes: np.ndarray) -> np.ndarray:
+    """
+    Распаковка цветов r<<16 | g<<8 | b обратно в RGB.
+
+    Args:
+        codes: Упакованные цвета (N,).
+
+    Returns:
+        np.ndarray: Цвета (N, 3) uint8.
+    """
+    return np.stack([codes >> 16, codes >> 8, codes], axis=1).astype(np.uint8)
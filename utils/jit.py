@@ -0,0 +1,23 @@
+from typing import Any, Callable
+
+try:
+    from numba import njit, prange
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args: Any, **kwargs: Any) -> Callable:
+        """
+        Заглушка для numba.njit, если numba не установлена: возвращает функцию без изменений.
+
+        Поддерживает оба варианта использования: @njit и @njit(cache=True, ...).
+        """
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+
+        def decorator(func: Callable) -> Callable:
+            return func
+
+        return decorator